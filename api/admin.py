@@ -1,14 +1,48 @@
 from django import forms
 from django.contrib import admin
+from django.db.models import Q
 from django_admin_inline_paginator.admin import TabularInlinePaginated
 
 from api.forms import ItemForm, ItemStockInlineForm
 from api.models import Item, Category, Item_Photos, Photo, Color, Size, ItemStock
+from api.pagination import EstimatedCountPaginator
 from api.widjets import ColorPickerWidget
 
-admin.site.register(Photo)
 admin.site.register(Size)
 
+
+class FastChangeListAdmin(admin.ModelAdmin):
+    """
+    Changelist that never counts the whole table and, through `list_only`,
+    loads only the columns its rows display. Set `list_select_related` for
+    every relation `list_display` renders, so a page costs a fixed number of queries.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_only = None
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        opts = self.model._meta
+        changelist = f'{opts.app_label}_{opts.model_name}_changelist'
+        if self.list_only and request.resolver_match and request.resolver_match.url_name == changelist:
+            queryset = queryset.only(*self.list_only)
+        return queryset
+
+@admin.register(Photo)
+class PhotoAdmin(FastChangeListAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
+    list_only = ('name',)
+    ordering = ('name',)
+
+    def get_search_results(self, request, queryset, search_term):
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        # The Item_Photos pickers only offer photos that no item uses yet.
+        if request.GET.get('model_name') == 'item_photos' and request.GET.get('field_name') == 'photo':
+            queryset = queryset.filter(item_photo__isnull=True)
+        return queryset, may_have_duplicates
+
 class ItemColorForm(forms.ModelForm):
     class Meta:
         model = Color
@@ -35,21 +69,24 @@ class Item_PhotosInline(TabularInlinePaginated):
     extra = 1
     readonly_fields = ('is_general_one', 'is_general_two')
     per_page = 5
+    # Options are searched through PhotoAdmin instead of rendered, so the page does not grow with the library.
+    autocomplete_fields = ('photo',)
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "photo":
-            # Получаем форму для текущего инлайна
-            form = self.form(request.POST, request.FILES, instance=kwargs.get('obj', None))
-            if form.fields['photo'].disabled:
-                kwargs["queryset"] = Photo.objects.filter(pk=form.instance.photo.pk)
-            else:
-                item_id = request.resolver_match.kwargs.get('object_id')
-                if item_id:
-                    kwargs["queryset"] = Photo.objects.filter(item_photo__item__id=item_id) | Photo.objects.filter(item_photo__isnull=True)
-                else:
-                    kwargs["queryset"] = Photo.objects.filter(item_photo__isnull=True)
+            kwargs["queryset"] = self.get_photo_queryset(request)
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
+    def get_photo_queryset(self, request):
+        """Photos a row may point to: free ones and those of this item. Built once per request."""
+        if not hasattr(request, '_item_photo_queryset'):
+            item_id = request.resolver_match.kwargs.get('object_id')
+            allowed = Q(item_photo__isnull=True)
+            if item_id:
+                allowed |= Q(item_photo__item_id=item_id)
+            request._item_photo_queryset = Photo.objects.filter(allowed)
+        return request._item_photo_queryset
+
 class ItemStockInline(TabularInlinePaginated):
     model = ItemStock
     form = ItemStockInlineForm
@@ -57,10 +94,17 @@ class ItemStockInline(TabularInlinePaginated):
     per_page = 5
 
 @admin.register(Item)
-class ItemAdmin(admin.ModelAdmin):
+class ItemAdmin(FastChangeListAdmin):
     form = ItemForm
     list_display = ('name', 'description', 'price',  'rating', 'order_count',
                     'discount', 'price_with_discount', 'general_photo_one', 'general_photo_two',)
+    # Item_Photos.__str__ renders the item and photo names.
+    list_select_related = ('general_photo_one__item', 'general_photo_one__photo',
+                           'general_photo_two__item', 'general_photo_two__photo')
+    list_only = ('name', 'description', 'price', 'rating', 'order_count', 'discount', 'price_with_discount',
+                 'general_photo_one__item__name', 'general_photo_one__photo__name',
+                 'general_photo_two__item__name', 'general_photo_two__photo__name')
+    search_fields = ('name',)
     readonly_fields = ('price_with_discount', )
     list_filter = ('categories',)
     inlines = [Item_PhotosInline, ItemStockInline]
@@ -69,22 +113,21 @@ class ItemAdmin(admin.ModelAdmin):
         if db_field.name in ['general_photo_one', 'general_photo_two']:
             item_id = request.resolver_match.kwargs.get('object_id')
             if item_id:
-                kwargs["queryset"] = Item_Photos.objects.filter(item_id=item_id)
+                kwargs["queryset"] = Item_Photos.objects.filter(item_id=item_id).select_related('item', 'photo')
             else:
                 kwargs["queryset"] = Item_Photos.objects.none()
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        obj.update_general_photos()
-
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name',)
 
 @admin.register(Item_Photos)
-class ItemPhotosAdmin(admin.ModelAdmin):
+class ItemPhotosAdmin(FastChangeListAdmin):
     list_display = ('item', 'photo', 'is_general_one', 'is_general_two' )
+    list_select_related = ('item', 'photo')
+    list_only = ('item__name', 'photo__name', 'is_general_one', 'is_general_two')
+    autocomplete_fields = ('item', 'photo')
 
     def get_readonly_fields(self, request, obj=None):
         if obj:
@@ -103,3 +146,13 @@ class ColorAdmin(admin.ModelAdmin):
     form = ItemColorForm
     list_display = ('name', 'hex')
 
+@admin.register(ItemStock)
+class ItemStockAdmin(FastChangeListAdmin):
+    list_display = ('__str__', 'quantity')
+    list_only = ('item__name', 'color', 'size', 'quantity')
+    search_fields = ('item__name',)
+    autocomplete_fields = ('item',)
+
+    def get_queryset(self, request):
+        # __str__ needs the item name, also for autocomplete results; color and size come from their caches.
+        return super().get_queryset(request).select_related('item')
@@ -0,0 +1,263 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+ITEMS = 'items'
+CATEGORIES = 'categories'
+
+VERSION_KEY = 'catalog:version:{}'
+STATS_KEY = 'catalog:stats:{}'
+
+_stats_lock = threading.Lock()
+_pending_stats = Counter()
+_stats_flushed_at = time.monotonic()
+
+
+def load_counters(scopes):
+    """
+    `{scope: (version, modified)}` of the shared counters in the database, so
+    a bump from any process (a worker, a management command) is seen by all
+    of them. Response bodies stay in the process-local cache, keyed by version.
+    """
+    from api.models import CatalogCounter  # api.models imports this module
+
+    names = {VERSION_KEY.format(scope): scope for scope in scopes}
+    stored = {name: (value, modified) for name, value, modified in
+              CatalogCounter.objects.filter(name__in=names).values_list('name', 'value', 'modified')}
+    missing = set(names) - set(stored)
+    if missing:
+        # Seed with a timestamp so a recreated counter never reuses an old version.
+        CatalogCounter.objects.bulk_create(
+            [CatalogCounter(name=name, value=int(time.time() * 1000), modified=int(time.time())) for name in missing],
+            ignore_conflicts=True,
+        )
+        stored.update({name: (value, modified) for name, value, modified in
+                       CatalogCounter.objects.filter(name__in=missing).values_list('name', 'value', 'modified')})
+    return {scope: stored[name] for name, scope in names.items()}
+
+
+def get_versions(scopes):
+    return {scope: version for scope, (version, _) in load_counters(scopes).items()}
+
+
+def bump_version(*scopes):
+    """
+    Bump the counters of `scopes` once the current transaction commits, or at
+    once outside of one. The counter rows are shared by every catalog writer,
+    so they are never locked for the length of a writer's transaction, and a
+    new version is only published when the data it invalidates is visible.
+    """
+    transaction.on_commit(lambda: increment_versions(scopes))
+
+
+def increment_versions(scopes):
+    from api.models import CatalogCounter
+
+    names = [VERSION_KEY.format(scope) for scope in scopes]
+    # Last-Modified has one second resolution, so the stamp always moves forward by at least that much,
+    # or a client that fetched between two bumps in one second would get 304 for the second change.
+    updated = CatalogCounter.objects.filter(name__in=names).update(
+        value=F('value') + 1, modified=Greatest(Value(int(time.time())), F('modified') + 1))
+    if updated < len(names):
+        load_counters(scopes)
+
+
+class DimensionCache:
+    """
+    Process-local `name -> ids` and `id -> row` maps of a tiny, rarely changing
+    table. The shared version counter, bumped by the model's save/delete
+    receivers in any process, is compared at most every `check_interval`
+    seconds, so lookups almost never leave the process; the receivers reset
+    the local copy at once. A lookup that misses rereads the rows, at most
+    once per `check_interval`, so rows written without signals (bulk_create,
+    queryset updates) are found too.
+    """
+    check_interval = 5
+
+    def __init__(self, model):
+        self.model = model
+        self.scope = f'dimension:{model._meta.label_lower}'
+        self.version = None
+        self.checked_at = 0
+        self.loaded_at = 0
+        self.by_id = {}
+        self.by_name = {}
+
+    def load(self, force=False):
+        now = time.monotonic()
+        if not force and self.version is not None and now - self.checked_at < self.check_interval:
+            return
+        # The version is read before the rows, so a concurrent change can only cause an extra reload.
+        version = get_versions([self.scope])[self.scope]
+        self.checked_at = now
+        if not force and version == self.version:
+            return
+        by_id, by_name = {}, {}
+        for row in self.model.objects.order_by('pk'):
+            by_id[row.pk] = row
+            by_name.setdefault(row.name, []).append(row.pk)
+        self.by_id, self.by_name, self.version, self.loaded_at = by_id, by_name, version, now
+
+    def reload_after_miss(self):
+        """Reread the rows unless they were read within `check_interval`; returns whether it did."""
+        if time.monotonic() - self.loaded_at < self.check_interval:
+            return False
+        self.load(force=True)
+        return True
+
+    def get(self, pk):
+        self.load()
+        if pk is not None and pk not in self.by_id:
+            self.reload_after_miss()
+        return self.by_id.get(pk)
+
+    def get_ids(self, names):
+        """Primary keys of every row called one of `names`; names are not unique."""
+        self.load()
+        if any(name not in self.by_name for name in names):
+            self.reload_after_miss()
+        return [pk for name in names for pk in self.by_name.get(name, ())]
+
+    def invalidate(self):
+        self.version = None
+        bump_version(self.scope)
+
+
+def record(event):
+    """Count a cache hit or miss in memory; the counts reach the database in batches."""
+    global _stats_flushed_at
+    with _stats_lock:
+        _pending_stats[event] += 1
+        due = (sum(_pending_stats.values()) >= settings.CATALOG_STATS_FLUSH_SIZE
+               or time.monotonic() - _stats_flushed_at >= settings.CATALOG_STATS_FLUSH_INTERVAL)
+        if not due:
+            return
+        pending = _pending_stats.copy()
+        _pending_stats.clear()
+        _stats_flushed_at = time.monotonic()
+    flush_stats(pending)
+
+
+def flush_stats(pending=None):
+    from api.models import CatalogCounter
+
+    if pending is None:
+        with _stats_lock:
+            pending = _pending_stats.copy()
+            _pending_stats.clear()
+    if not pending:
+        return
+    CatalogCounter.objects.bulk_create(
+        [CatalogCounter(name=STATS_KEY.format(event)) for event in pending], ignore_conflicts=True,
+    )
+    for event, count in pending.items():
+        CatalogCounter.objects.filter(name=STATS_KEY.format(event)).update(value=F('value') + count)
+
+
+def get_stats():
+    from api.models import CatalogCounter
+
+    flush_stats()
+    stored = dict(CatalogCounter.objects.filter(
+        name__in=[STATS_KEY.format('hits'), STATS_KEY.format('misses')]).values_list('name', 'value'))
+    hits = stored.get(STATS_KEY.format('hits'), 0)
+    misses = stored.get(STATS_KEY.format('misses'), 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+        'versions': get_versions([ITEMS, CATEGORIES]),
+    }
+
+
+def normalize_query(query_params):
+    """Stable representation of the query string: sorted keys, sorted `populate`."""
+    normalized = []
+    for key in sorted(query_params):
+        values = query_params.getlist(key)
+        if key == 'populate':
+            values = sorted({part for value in values for part in value.split(',') if part})
+        normalized.append((key, ','.join(values)))
+    return '&'.join(f'{key}={value}' for key, value in normalized)
+
+
+def build_cache_key(request, scopes, versions=None):
+    versions = versions or get_versions(scopes)
+    url = f'{request.scheme}://{request.get_host()}{request.path}?{normalize_query(request.query_params)}'
+    digest = hashlib.md5(url.encode('utf-8')).hexdigest()
+    version = '.'.join(str(versions[scope]) for scope in scopes)
+    return f'catalog:response:{version}:{digest}'
+
+
+def get_validators(request, scopes):
+    """Response cache key, ETag and Last-Modified of `request`, from a single read of the counters."""
+    counters = load_counters(scopes)
+    key = build_cache_key(request, scopes, {scope: version for scope, (version, _) in counters.items()})
+    etag = quote_etag(hashlib.md5(key.encode('utf-8')).hexdigest())
+    last_modified = max(modified for _, modified in counters.values())
+    return key, etag, last_modified
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code == status.HTTP_200_OK:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def conditional_response(*scopes):
+    """
+    Answer `304 Not Modified` from the version counters of `scopes` alone,
+    without running the view, and stamp ETag/Last-Modified on 200 responses.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            _, etag, last_modified = get_validators(request, scopes)
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return not_modified
+            return set_validators(method(view, request, *args, **kwargs), etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def cached_response(*scopes):
+    """
+    Cache successful responses of a catalog view method until one of the
+    version counters of `scopes` is bumped by a model signal. Conditional
+    requests are answered before the cache is even consulted.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key, etag, last_modified = get_validators(request, scopes)
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return not_modified
+
+            data = cache.get(key)
+            if data is not None:
+                record('hits')
+                return set_validators(Response(data), etag, last_modified)
+
+            record('misses')
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+            return set_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,155 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from api import cache as catalog_cache
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'derivatives'
+
+_executor = None
+
+
+def get_formats():
+    """Configured derivative formats that this Pillow build can actually encode (AVIF needs a plugin)."""
+    Image.init()
+    return [fmt for fmt in settings.IMAGE_DERIVATIVE_FORMATS if fmt.upper() in Image.SAVE]
+
+
+def get_derivative_name(name, width, fmt):
+    # The original extension stays in the name: `foo.jpg` and `foo.png` are different uploads.
+    return f'{DERIVATIVES_DIR}/{name}-{width}w.{fmt}'
+
+
+def get_srcset(name, derivatives, build_url=None):
+    """
+    `{format: "url 320w, url 640w, ..."}` for an original file name, listing
+    only the derivatives its row records as built, or `None` while none are.
+    Rows with a `photo` keep that record in their `derivatives` field as the
+    manifest returned by `generate_derivatives`, `{format: [widths]}`.
+    """
+    if not name or not derivatives:
+        return None
+
+    srcset = {}
+    for fmt, widths in derivatives.items():
+        urls = []
+        for width in widths:
+            url = default_storage.url(get_derivative_name(name, width, fmt))
+            urls.append(f'{build_url(url) if build_url else url} {width}w')
+        srcset[fmt] = ', '.join(urls)
+    return srcset
+
+
+def generate_derivatives(name):
+    """
+    Write every width/format variant of `name`; the original is decoded only
+    once. Returns the `{format: [widths]}` manifest of what was written.
+    """
+    try:
+        with default_storage.open(name) as file:
+            original = ImageOps.exif_transpose(Image.open(file))
+            original.load()
+    except (OSError, ValueError) as exc:
+        logger.warning('Cannot build derivatives of %s: %s', name, exc)
+        return {}
+
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    built = {}
+    for width in settings.IMAGE_DERIVATIVE_WIDTHS:
+        image = original.copy()
+        # Never upscales; the height bound only keeps the aspect ratio.
+        image.thumbnail((width, width * 10), Image.LANCZOS)
+        for fmt in get_formats():
+            buffer = BytesIO()
+            derivative = get_derivative_name(name, width, fmt)
+            try:
+                image.save(buffer, format=fmt.upper(), quality=settings.IMAGE_DERIVATIVE_QUALITY)
+                default_storage.delete(derivative)
+                default_storage.save(derivative, ContentFile(buffer.getvalue()))
+            except (OSError, ValueError) as exc:
+                logger.warning('Cannot build %s: %s', derivative, exc)
+                continue
+            built.setdefault(fmt, []).append(width)
+    return built
+
+
+def record_derivatives(name, derivatives):
+    """Store the manifest on every row whose `photo` is still `name`; rows keep `{}` until then."""
+    updated = 0
+    for model in apps.get_models():
+        if any(field.name == 'derivatives' for field in model._meta.concrete_fields):
+            updated += model._default_manager.filter(photo=name).update(derivatives=derivatives)
+    if updated:
+        # Cached catalog responses carry the srcset.
+        catalog_cache.bump_version(catalog_cache.ITEMS, catalog_cache.CATEGORIES)
+
+
+def delete_derivatives(name):
+    if not name:
+        return
+    for width in settings.IMAGE_DERIVATIVE_WIDTHS:
+        for fmt in get_formats():
+            default_storage.delete(get_derivative_name(name, width, fmt))
+
+
+def delete_files(names):
+    for name in names:
+        delete_derivatives(name)
+        default_storage.delete(name)
+    return len(names)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_DERIVATIVE_WORKERS)
+    return _executor
+
+
+def schedule_derivatives(name):
+    """
+    Build the derivatives in the worker pool once the upload is committed, so
+    the admin request never waits for Pillow, then record them on the rows.
+    With no workers configured the `build_image_derivatives` command is
+    expected to pick them up instead.
+    """
+    if not name or not settings.IMAGE_DERIVATIVE_WORKERS:
+        return
+
+    def record(future):
+        # Runs in the pool's management thread: the workers never touch the database, and the
+        # connection of this thread is not managed by the request cycle, so it is checked here.
+        close_old_connections()
+        try:
+            record_derivatives(name, future.result())
+        except Exception:
+            logger.exception('Cannot build derivatives of %s', name)
+        finally:
+            close_old_connections()
+
+    transaction.on_commit(lambda: get_executor().submit(generate_derivatives, name).add_done_callback(record))
+
+
+def schedule_delete(file):
+    """
+    Remove a replaced or deleted upload and its derivatives in the worker
+    pool once the change is committed, so a rolled back delete keeps its file
+    and the admin request never waits for the filesystem. Field defaults are
+    shared and never removed; with no workers configured `gc_media` collects
+    the orphan instead.
+    """
+    if not file or file.name == file.field.default or not settings.IMAGE_DERIVATIVE_WORKERS:
+        return
+    name = file.name
+    transaction.on_commit(lambda: get_executor().submit(delete_files, [name]))
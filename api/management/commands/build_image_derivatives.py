@@ -0,0 +1,32 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from api import images
+from api.models import Photo, Category
+from user_profile.models import ReviewPhoto
+
+
+class Command(BaseCommand):
+    help = (
+        'Build resized WebP/AVIF derivatives of every uploaded photo in a process pool '
+        'and record on each row which ones exist'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (defaults to the number of CPUs)')
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in (Photo, Category, ReviewPhoto):
+            names.update(model.objects.exclude(photo='').values_list('photo', flat=True).distinct())
+
+        names = sorted(names)
+        created = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for name, derivatives in zip(names, executor.map(images.generate_derivatives, names, chunksize=16)):
+                images.record_derivatives(name, derivatives)
+                created += sum(len(widths) for widths in derivatives.values())
+
+        self.stdout.write(self.style.SUCCESS(f'Built {created} derivatives of {len(names)} photos'))
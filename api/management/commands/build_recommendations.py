@@ -0,0 +1,114 @@
+from collections import Counter, defaultdict
+from itertools import permutations
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from api import cache as catalog_cache
+from api.models import ItemCooccurrence, ItemRecommendation
+from orders.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Count item co-occurrence in the paid orders not counted yet and refresh the '
+        'top-k "also bought" lists of the affected items'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--rebuild', action='store_true', help='Drop all counts and rescan every paid order')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['rebuild']:
+            with transaction.atomic():
+                ItemCooccurrence.objects.all().delete()
+                ItemRecommendation.objects.all().delete()
+                Order.objects.filter(counted_in_recommendations=True).update(counted_in_recommendations=False)
+
+        order_ids = list(Order.objects.filter(status__in=Order.PAID_STATUSES, counted_in_recommendations=False)
+                         .order_by('pk').values_list('pk', flat=True))
+        item_ids = set()
+        counted = 0
+        for start in range(0, len(order_ids), batch_size):
+            with transaction.atomic():
+                claimed, affected = self.count_orders(order_ids[start:start + batch_size])
+            counted += claimed
+            item_ids |= affected
+
+        item_ids = sorted(item_ids)
+        for start in range(0, len(item_ids), batch_size):
+            self.refresh_top_k(item_ids[start:start + batch_size], options['top_k'])
+        catalog_cache.bump_version(catalog_cache.ITEMS)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Counted {counted} orders, refreshed recommendations of {len(item_ids)} items'))
+
+    def count_orders(self, order_ids):
+        """
+        Add the item pairs of `order_ids` to the co-occurrence matrix; returns
+        the number of orders counted and the affected items. Orders another
+        run has locked or already counted are left to it.
+        """
+        order_ids = list(Order.objects.select_for_update(skip_locked=True).filter(
+            pk__in=order_ids, counted_in_recommendations=False).values_list('pk', flat=True))
+
+        baskets = defaultdict(set)
+        for order_id, item_id in OrderItem.objects.filter(order_id__in=order_ids).values_list(
+                'order_id', 'product__item_id'):
+            if item_id is not None:
+                baskets[order_id].add(item_id)
+
+        # Sparse delta matrix keyed by (item, other), both directions.
+        deltas = Counter()
+        for item_ids in baskets.values():
+            deltas.update(permutations(item_ids, 2))
+
+        self.add_counts(deltas)
+        Order.objects.filter(pk__in=order_ids).update(counted_in_recommendations=True)
+        return len(order_ids), {item_id for item_id, _ in deltas}
+
+    def add_counts(self, deltas, batch_size=5000):
+        """
+        Upsert `{(item, other): delta}` with `count = count + EXCLUDED.count`,
+        so concurrent runs add to each other's counts instead of overwriting them.
+        """
+        quote_name = connection.ops.quote_name
+        table = quote_name(ItemCooccurrence._meta.db_table)
+        sql = f"""
+            INSERT INTO {table} (item_id, other_id, count)
+            SELECT * FROM unnest(%s::bigint[], %s::bigint[], %s::integer[])
+            ON CONFLICT (item_id, other_id) DO UPDATE SET count = {table}.count + EXCLUDED.count
+        """
+        # Sorted so runs sharing cells lock them in the same order and never deadlock.
+        cells = sorted(deltas.items())
+        with connection.cursor() as cursor:
+            for start in range(0, len(cells), batch_size):
+                batch = cells[start:start + batch_size]
+                cursor.execute(sql, [
+                    [item_id for (item_id, _), _ in batch],
+                    [other_id for (_, other_id), _ in batch],
+                    [delta for _, delta in batch],
+                ])
+
+    def refresh_top_k(self, item_ids, top_k):
+        """Rewrite the recommendation rows of `item_ids` from their `top_k` strongest neighbours."""
+        ranked = ItemCooccurrence.objects.filter(item_id__in=item_ids).annotate(
+            rank=Window(RowNumber(), partition_by=F('item_id'), order_by=[F('count').desc(), F('other_id').asc()]),
+        ).filter(rank__lte=top_k).order_by('item_id', 'rank').values_list('item_id', 'other_id')
+
+        neighbours = {item_id: [] for item_id in item_ids}
+        for item_id, other_id in ranked:
+            neighbours[item_id].append(other_id)
+
+        ItemRecommendation.objects.bulk_create(
+            [ItemRecommendation(item_id=item_id, also_bought=other_ids) for item_id, other_ids in neighbours.items()],
+            update_conflicts=True,
+            unique_fields=['item'],
+            update_fields=['also_bought'],
+        )
@@ -0,0 +1,83 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from api import images
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete files under MEDIA_ROOT that no file field references any more, '
+        'together with derivatives of photos that are gone'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the orphaned files')
+        parser.add_argument('--workers', type=int, default=8, help='Threads removing files in parallel')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Skip files modified less than this many seconds ago (uploads not committed yet)')
+
+    def handle(self, *args, **options):
+        referenced = self.get_referenced_names()
+        cutoff = time.time() - options['min_age']
+        orphans = [(path, size) for path, name, size, mtime in self.walk(settings.MEDIA_ROOT)
+                   if name not in referenced and mtime <= cutoff]
+        freed = sum(size for _, size in orphans)
+
+        if options['dry_run']:
+            for path, _ in orphans:
+                self.stdout.write(path)
+            self.stdout.write(f'{len(orphans)} orphaned files, {freed / 2 ** 20:.1f} MiB')
+            return
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            removed = sum(executor.map(self.remove, (path for path, _ in orphans)))
+
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} orphaned files, {freed / 2 ** 20:.1f} MiB'))
+
+    def get_referenced_names(self):
+        """Every stored name of every file field in the project, field defaults and current derivatives."""
+        names = set()
+        for model in apps.get_models():
+            for field in model._meta.concrete_fields:
+                if not isinstance(field, models.FileField):
+                    continue
+                if isinstance(field.default, str):
+                    names.add(field.default)
+                names.update(model._default_manager.exclude(**{field.name: ''})
+                             .values_list(field.name, flat=True).distinct().iterator(chunk_size=5000))
+
+        formats = images.get_formats()
+        for name in list(names):
+            for width in settings.IMAGE_DERIVATIVE_WIDTHS:
+                names.update(images.get_derivative_name(name, width, fmt) for fmt in formats)
+        return names
+
+    def walk(self, root):
+        """Yield `(path, storage name, size, mtime)` of every file below `root` without following links."""
+        directories = [root]
+        while directories:
+            try:
+                entries = os.scandir(directories.pop())
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                        yield entry.path, name, stat.st_size, stat.st_mtime
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return 1
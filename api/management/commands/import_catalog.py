@@ -0,0 +1,156 @@
+import csv
+import json
+import time
+from decimal import Decimal
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from api import cache as catalog_cache
+from api.models import Item, Category, Color, Size, ItemStock, refresh_item_cards, refresh_category_stats, \
+    color_cache, size_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream a CSV or JSONL supplier catalog into Item, Category, Color, Size and ItemStock '
+        'with bulk upserts, bypassing the per-row save signals'
+    )
+    item_fields = ('name', 'description', 'price', 'discount', 'information', 'brand', 'feature', 'size_table')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (one row per variant) or JSONL (one item per line) file')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        batch_size = options['batch_size']
+
+        self.category_ids = dict(Category.objects.values_list('name', 'pk'))
+        self.color_ids = dict(Color.objects.values_list('name', 'pk'))
+        self.size_ids = dict(Size.objects.values_list('name', 'pk'))
+
+        category_ids = set()
+        total = 0
+        started = time.monotonic()
+        with open(path, newline='', encoding='utf-8') as file:
+            rows = self.read_rows(file, file_format)
+            while batch := list(islice(rows, batch_size)):
+                with transaction.atomic():
+                    category_ids |= self.import_batch(batch)
+                total += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'{total} rows imported, {total / elapsed:.0f} rows/s')
+
+        # Derived data that the skipped signals would have maintained row by row.
+        refresh_category_stats(category_ids)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Item]):
+                cursor.execute(sql)
+        catalog_cache.bump_version(catalog_cache.ITEMS, catalog_cache.CATEGORIES)
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {total} rows in {time.monotonic() - started:.1f}s'))
+
+    def read_rows(self, file, file_format):
+        """
+        Yield rows as `{'id', <item fields>, 'categories': [...], 'stocks': [...]}`.
+        CSV rows carry `|`-separated categories and at most one color/hex/size/quantity variant.
+        """
+        if file_format == 'jsonl':
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    raise CommandError(f'Line {line_number}: {exc}')
+                yield self.clean_row(row, line_number)
+            return
+
+        for line_number, row in enumerate(csv.DictReader(file), start=2):
+            row['categories'] = [name for name in (row.get('categories') or '').split('|') if name]
+            row['stocks'] = []
+            if row.get('quantity'):
+                row['stocks'].append({key: row.get(key) for key in ('color', 'hex', 'size', 'quantity')})
+            yield self.clean_row(row, line_number)
+
+    def clean_row(self, row, line_number):
+        if not isinstance(row, dict):
+            raise CommandError(f'Line {line_number}: expected an object, got {type(row).__name__}')
+        row['categories'] = row.get('categories') or []
+        row['stocks'] = row.get('stocks') or []
+        if not isinstance(row['categories'], list) or not all(isinstance(name, str) for name in row['categories']):
+            raise CommandError(f'Line {line_number}: categories must be a list of names')
+        if not isinstance(row['stocks'], list) or not all(isinstance(stock, dict) for stock in row['stocks']):
+            raise CommandError(f'Line {line_number}: stocks must be a list of objects')
+        try:
+            row['id'] = int(row['id'])
+            row['price'] = Decimal(str(row.get('price') or 0))
+            row['discount'] = Decimal(str(row.get('discount') or 0))
+            for stock in row['stocks']:
+                stock['quantity'] = int(stock['quantity'])
+        except (KeyError, TypeError, ValueError, ArithmeticError) as exc:
+            raise CommandError(f'Line {line_number}: invalid row ({exc!r})')
+        return row
+
+    def import_batch(self, rows):
+        items = {}
+        links = set()
+        quantities = {}
+
+        self.create_missing(Category, self.category_ids, {name: {} for row in rows for name in row['categories']})
+        # bulk_create sends no signals, so the dimension caches of every process are invalidated here.
+        if self.create_missing(Color, self.color_ids, {stock.get('color'): {'hex': stock.get('hex') or '#FF0000'}
+                                                       for row in rows for stock in row['stocks']}):
+            color_cache.invalidate()
+        if self.create_missing(Size, self.size_ids, {stock.get('size'): {} for row in rows for stock in row['stocks']}):
+            size_cache.invalidate()
+
+        for row in rows:
+            item = Item(pk=row['id'], **{field: row.get(field) or '' for field in self.item_fields})
+            item.price, item.discount = row['price'], row['discount']
+            item.price_with_discount = item.price * (1 - item.discount)
+            item.search_name, item.search_document = item.build_search_fields()
+            items[item.pk] = item
+
+            links.update((item.pk, self.category_ids[name]) for name in row['categories'])
+            for stock in row['stocks']:
+                key = (item.pk, self.color_ids.get(stock.get('color')), self.size_ids.get(stock.get('size')))
+                quantities[key] = stock['quantity']
+
+        Item.objects.bulk_create(
+            items.values(),
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=[*self.item_fields, 'price_with_discount', 'search_name', 'search_document'],
+        )
+        Item.categories.through.objects.bulk_create(
+            [Item.categories.through(item_id=item_id, category_id=category_id) for item_id, category_id in links],
+            ignore_conflicts=True,
+        )
+        self.upsert_stocks(quantities)
+
+        Item.update_stock_totals(*items)
+        refresh_item_cards(items)
+        return set(Item.categories.through.objects.filter(item_id__in=items)
+                   .values_list('category_id', flat=True))
+
+    def create_missing(self, model, ids, defaults):
+        """Insert the names not seen yet in one query, remember their primary keys and return how many."""
+        missing = [model(name=name, **extra) for name, extra in defaults.items() if name and name not in ids]
+        for instance in model.objects.bulk_create(missing):
+            ids[instance.name] = instance.pk
+        return len(missing)
+
+    def upsert_stocks(self, quantities):
+        ItemStock.objects.bulk_create(
+            [ItemStock(item_id=item_id, color_id=color_id, size_id=size_id, quantity=quantity)
+             for (item_id, color_id, size_id), quantity in quantities.items()],
+            update_conflicts=True,
+            unique_fields=['item', 'color', 'size'],
+            update_fields=['quantity'],
+        )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Item, ItemCard, refresh_item_cards
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized ItemCard listing rows for every item'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        item_ids = list(Item.objects.order_by('pk').values_list('pk', flat=True))
+
+        for start in range(0, len(item_ids), batch_size):
+            refresh_item_cards(item_ids[start:start + batch_size])
+
+        ItemCard.objects.exclude(item__in=Item.objects.all()).delete()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(item_ids)} item cards'))
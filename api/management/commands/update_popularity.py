@@ -0,0 +1,57 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from api import cache as catalog_cache
+from api.models import Item, ItemCard, ItemDailyViews
+from api.popularity import decay
+from orders.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the time-decayed popularity of every item from the paid sales and detail '
+        'page views of the last POPULARITY_WINDOW_DAYS days'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        since = today - timedelta(days=settings.POPULARITY_WINDOW_DAYS)
+        scores = defaultdict(float)
+
+        # One row per item and day, so the decay is applied to daily totals rather than single events.
+        sales = OrderItem.objects.filter(
+            order__status__in=Order.PAID_STATUSES, order__created_at__date__gte=since,
+        ).annotate(day=TruncDate('order__created_at')).values_list('product__item_id', 'day').annotate(
+            total=Sum('quantity'))
+        for item_id, day, total in sales:
+            scores[item_id] += total * decay((today - day).days)
+
+        views = ItemDailyViews.objects.filter(day__gte=since).values_list('item_id', 'day', 'views')
+        for item_id, day, count in views:
+            scores[item_id] += count * settings.POPULARITY_VIEW_WEIGHT * decay((today - day).days)
+
+        with transaction.atomic():
+            existing = Item.objects.filter(pk__in=scores).values_list('pk', flat=True)
+            items = [Item(pk=item_id, popularity=round(scores[item_id], 6)) for item_id in existing]
+            Item.objects.bulk_update(items, ['popularity'], batch_size=options['batch_size'])
+            # Items that dropped out of the window.
+            stale = Item.objects.exclude(pk__in=scores).exclude(popularity=0).update(popularity=0)
+
+            cards = [ItemCard(item_id=item.pk, popularity=item.popularity) for item in items]
+            ItemCard.objects.bulk_update(cards, ['popularity'], batch_size=options['batch_size'])
+            ItemCard.objects.exclude(item_id__in=scores).exclude(popularity=0).update(popularity=0)
+
+        ItemDailyViews.objects.filter(day__lt=since).delete()
+        catalog_cache.bump_version(catalog_cache.ITEMS)
+
+        self.stdout.write(self.style.SUCCESS(f'Scored {len(items)} items, reset {stale} stale scores'))
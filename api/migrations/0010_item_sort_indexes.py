@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_alter_itemstock_color_alter_itemstock_size'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['order_count', 'id'], name='item_order_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['price', 'id'], name='item_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['discount', 'id'], name='item_discount_idx'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:16
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Prefetch
+
+
+def fill_item_cards(apps, schema_editor):
+    Item = apps.get_model('api', 'Item')
+    ItemCard = apps.get_model('api', 'ItemCard')
+    ItemStock = apps.get_model('api', 'ItemStock')
+
+    def photo_url(item_photo):
+        if item_photo and item_photo.photo.photo:
+            return item_photo.photo.photo.url
+        return ''
+
+    items = Item.objects.order_by('pk').select_related(
+        'general_photo_one__photo', 'general_photo_two__photo',
+    ).prefetch_related(
+        'categories',
+        Prefetch('stocks', queryset=ItemStock.objects.order_by('pk').select_related('color', 'size')),
+    )
+    cards = []
+    for item in items.iterator(chunk_size=1000):
+        stocks = list(item.stocks.all())
+        colors, sizes = {}, {}
+        for stock in stocks:
+            if stock.color:
+                colors.setdefault(stock.color.name, {'name': stock.color.name, 'hex': stock.color.hex})
+            if stock.size:
+                sizes.setdefault(stock.size.name, {'name': stock.size.name})
+        cards.append(ItemCard(
+            item=item,
+            name=item.name,
+            price=item.price,
+            discount=item.discount,
+            price_with_discount=item.price_with_discount,
+            rating=item.rating,
+            order_count=item.order_count,
+            general_photo_one=photo_url(item.general_photo_one),
+            general_photo_two=photo_url(item.general_photo_two),
+            category_slugs=[category.slug for category in item.categories.all()],
+            colors=list(colors.values()),
+            sizes=list(sizes.values()),
+            total_stock=sum(stock.quantity for stock in stocks),
+        ))
+    ItemCard.objects.bulk_create(cards, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_item_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemCard',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='api.item')),
+                ('name', models.CharField(max_length=100)),
+                ('price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('discount', models.DecimalField(decimal_places=2, default=0, max_digits=3)),
+                ('price_with_discount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('rating', models.DecimalField(decimal_places=1, default=0, max_digits=2)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('general_photo_one', models.CharField(blank=True, max_length=255)),
+                ('general_photo_two', models.CharField(blank=True, max_length=255)),
+                ('category_slugs', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), blank=True, default=list, size=None)),
+                ('colors', models.JSONField(blank=True, default=list)),
+                ('sizes', models.JSONField(blank=True, default=list)),
+                ('total_stock', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['category_slugs'], name='item_card_categories_idx'), models.Index(fields=['order_count', 'item'], name='item_card_order_count_idx'), models.Index(fields=['price', 'item'], name='item_card_price_idx'), models.Index(fields=['discount', 'item'], name='item_card_discount_idx'), models.Index(fields=['price_with_discount'], name='item_card_pwd_idx')],
+            },
+        ),
+        migrations.RunPython(fill_item_cards, migrations.RunPython.noop),
+    ]
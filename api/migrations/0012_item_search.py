@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:22
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+from unidecode import unidecode
+
+
+def normalize_search_text(value):
+    return ' '.join(unidecode(value or '').lower().split())
+
+
+def fill_search_fields(apps, schema_editor):
+    Item = apps.get_model('api', 'Item')
+    items = list(Item.objects.only('name', 'brand', 'feature', 'description'))
+    for item in items:
+        item.search_name = normalize_search_text(item.name)
+        item.search_document = normalize_search_text(' '.join([item.brand, item.feature, item.description]))
+    Item.objects.bulk_update(items, ['search_name', 'search_document'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_itemcard'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='item',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='search_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_search_fields, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='item',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('search_name', config='simple', weight='A'), '||', django.contrib.postgres.search.SearchVector('search_document', config='simple', weight='B'), django.contrib.postgres.search.SearchConfig('simple')), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='item_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_name'], name='item_search_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:25
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_stock_totals(apps, schema_editor):
+    Item = apps.get_model('api', 'Item')
+    ItemStock = apps.get_model('api', 'ItemStock')
+    stocks = ItemStock.objects.filter(item=OuterRef('pk'))
+    totals = stocks.values('item').annotate(total=Sum('quantity')).values('total')
+    Item.objects.update(
+        total_stock=Coalesce(Subquery(totals), 0, output_field=models.PositiveIntegerField()),
+        is_in_stock=Exists(stocks.filter(quantity__gt=0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_item_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='is_in_stock',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='total_stock',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_stock_totals, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_in_stock', True)), fields=['order_count', 'id'], name='item_in_stock_order_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_in_stock', True)), fields=['price', 'id'], name='item_in_stock_price_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+
+def fill_category_stats(apps, schema_editor):
+    Category = apps.get_model('api', 'Category')
+    CategoryStats = apps.get_model('api', 'CategoryStats')
+    stats = Category.objects.annotate(
+        min_price=Min('items__price_with_discount'),
+        max_price=Max('items__price_with_discount'),
+        item_count=Count('items'),
+        in_stock_count=Count('items', filter=Q(items__is_in_stock=True)),
+        discounted_count=Count('items', filter=Q(items__discount__gt=0)),
+    ).values('pk', 'min_price', 'max_price', 'item_count', 'in_stock_count', 'discounted_count')
+    CategoryStats.objects.bulk_create(
+        [CategoryStats(category_id=row.pop('pk'), **row) for row in stats], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_item_stock_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='api.category')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('in_stock_count', models.PositiveIntegerField(default=0)),
+                ('discounted_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_category_stats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['price_with_discount'], name='item_price_with_discount_idx'),
+        ),
+    ]
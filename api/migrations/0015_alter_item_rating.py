@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:41
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_categorystats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='rating',
+            field=models.DecimalField(decimal_places=1, default=0, editable=False, max_digits=2, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(5)]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:48
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_alter_item_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemRecommendation',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendation', serialize=False, to='api.item')),
+                ('also_bought', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), default=list, size=None)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ItemCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.item')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.item')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='itemcooccurrence',
+            constraint=models.UniqueConstraint(fields=('item', 'other'), name='item_cooccurrence_unique'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_item_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemDailyViews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='popularity',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='itemcard',
+            name='popularity',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['popularity', 'id'], name='item_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_in_stock', True)), fields=['popularity', 'id'], name='item_in_stock_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemcard',
+            index=models.Index(fields=['popularity', 'item'], name='item_card_popularity_idx'),
+        ),
+        migrations.AddField(
+            model_name='itemdailyviews',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.item'),
+        ),
+        migrations.AddConstraint(
+            model_name='itemdailyviews',
+            constraint=models.UniqueConstraint(fields=('item', 'day'), name='item_daily_views_unique'),
+        ),
+    ]
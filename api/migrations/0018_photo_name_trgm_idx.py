@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:00
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_item_popularity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='photo_name_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_stocks(apps, schema_editor):
+    """Fold rows of the same variant into the oldest one, moving their references and quantity to it."""
+    ItemStock = apps.get_model('api', 'ItemStock')
+    referencing = [apps.get_model('purchases', 'BasketItem'), apps.get_model('purchases', 'FavouritesItem'),
+                   apps.get_model('orders', 'OrderItem')]
+    duplicates = ItemStock.objects.values('item_id', 'color_id', 'size_id').annotate(
+        keep=Min('pk'), total=Sum('quantity'), rows=Count('pk'),
+    ).filter(rows__gt=1)
+    for variant in duplicates:
+        others = ItemStock.objects.filter(
+            item_id=variant['item_id'], color_id=variant['color_id'], size_id=variant['size_id'],
+        ).exclude(pk=variant['keep'])
+        for model in referencing:
+            model.objects.filter(product__in=others).update(product_id=variant['keep'])
+        others.delete()
+        ItemStock.objects.filter(pk=variant['keep']).update(quantity=variant['total'])
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_photo_name_trgm_idx'),
+        ('orders', '0002_order_counted_in_recommendations'),
+        ('purchases', '0006_payment_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stocks, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='itemstock',
+            constraint=models.UniqueConstraint(fields=('item', 'color', 'size'), name='item_stock_variant_unique', nulls_distinct=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_itemstock_variant_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCounter',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+                ('modified', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,18 +1,44 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models, transaction
 from autoslug import AutoSlugField
-from django.db.models import Sum, Avg
-from django.db.models.signals import post_delete, pre_save, post_save
+from django.db.models import Sum, Prefetch, Count, OuterRef, Subquery, Exists, Q, Min, Max, ExpressionWrapper, F, Value
+from django.db.models.functions import Coalesce, Greatest, Least, Upper
+from django.db.models.signals import post_delete, pre_save, post_save, m2m_changed, pre_delete
 from django.dispatch import receiver
 from django import forms
 from django.urls import reverse
 from django.utils.html import format_html
 from unidecode import unidecode
 
+from api import cache as catalog_cache
+from api import images
+
+def normalize_search_text(value):
+    """Transliterate like `Category.get_slug` so Cyrillic and Latin spellings meet."""
+    return ' '.join(unidecode(value or '').lower().split())
+
+
+class CategoryQuerySet(models.QuerySet):
+    def with_item_count(self):
+        """Annotate `item_count` with a correlated subquery instead of a COUNT per category."""
+        counts = self.model.items.through.objects.filter(category=OuterRef('pk')).values(
+            'category').annotate(count=Count('pk')).values('count')
+        return self.annotate(item_count=Coalesce(Subquery(counts), 0))
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = AutoSlugField(populate_from='get_slug', unique=True, always_update=True, default='temp-slug')
     photo = models.ImageField(upload_to='categories/', blank=True)
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
 
     def get_slug(self):
         return unidecode(self.name)
@@ -27,7 +53,8 @@ class Item(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], default=0)
     categories = models.ManyToManyField(Category, related_name='items')
     rating = models.DecimalField(max_digits=2, decimal_places=1,
-                                 validators=[MinValueValidator(0), MaxValueValidator(5)], default=0)
+                                 validators=[MinValueValidator(0), MaxValueValidator(5)], default=0,
+                                 editable=False)
     order_count = models.PositiveIntegerField(default=0)
     discount = models.DecimalField(max_digits=3, decimal_places=2,
                                    validators=[MinValueValidator(0), MaxValueValidator(1)], default=0)
@@ -44,36 +71,90 @@ class Item(models.Model):
     brand = models.TextField(blank=True)
     feature = models.TextField(blank=True)
     size_table = models.TextField(blank=True)
-    _updating = False
+    total_stock = models.PositiveIntegerField(default=0, editable=False)
+    is_in_stock = models.BooleanField(default=False, editable=False)
+    popularity = models.FloatField(default=0, editable=False)
+    search_name = models.CharField(max_length=255, blank=True, editable=False)
+    search_document = models.TextField(blank=True, editable=False)
+    search_vector = models.GeneratedField(
+        expression=SearchVector('search_name', weight='A', config='simple')
+        + SearchVector('search_document', weight='B', config='simple'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_count', 'id'], name='item_order_count_idx'),
+            models.Index(fields=['price', 'id'], name='item_price_idx'),
+            models.Index(fields=['discount', 'id'], name='item_discount_idx'),
+            models.Index(fields=['order_count', 'id'], condition=Q(is_in_stock=True),
+                         name='item_in_stock_order_count_idx'),
+            models.Index(fields=['price', 'id'], condition=Q(is_in_stock=True), name='item_in_stock_price_idx'),
+            models.Index(fields=['price_with_discount'], name='item_price_with_discount_idx'),
+            models.Index(fields=['popularity', 'id'], name='item_popularity_idx'),
+            models.Index(fields=['popularity', 'id'], condition=Q(is_in_stock=True),
+                         name='item_in_stock_popularity_idx'),
+            GinIndex(fields=['search_vector'], name='item_search_vector_idx'),
+            GinIndex(fields=['search_name'], opclasses=['gin_trgm_ops'], name='item_search_name_trgm_idx'),
+        ]
+
+    # Maintained in the database by update_stock_totals, ItemRating and update_popularity,
+    # never written from a possibly stale instance.
+    maintained_fields = ('total_stock', 'is_in_stock', 'rating', 'popularity')
+    general_photo_fields = ('general_photo_one', 'general_photo_two')
 
     def save(self, *args, **kwargs):
-        self.skip_update = kwargs.pop('skip_update', False)
         self.price_with_discount = self.price * (1 - self.discount)
-        super().save(*args, **kwargs)
-        if not self.skip_update:
-            self.update_general_photos()
-
-    def update_general_photos(self):
-        if not self._updating:
-            self._updating = True
-
-            if self.general_photo_one:
-                Item_Photos.objects.filter(item=self, is_general_one=True).exclude(pk=self.general_photo_one.pk).update(is_general_one=False)
-                self.general_photo_one.is_general_one = True
-                self.general_photo_one.save(update_fields=['is_general_one'])
-            else:
-                Item_Photos.objects.filter(item=self, is_general_one=True).update(
-                    is_general_one=False)
-
-            if self.general_photo_two:
-                Item_Photos.objects.filter(item=self, is_general_two=True).exclude(pk=self.general_photo_two.pk).update(is_general_two=False)
-                self.general_photo_two.is_general_two = True
-                self.general_photo_two.save(update_fields=['is_general_two'])
-            else:
-                Item_Photos.objects.filter(item=self, is_general_two=True).update(
-                    is_general_two=False)
-
-            self._updating = False
+        self.search_name, self.search_document = self.build_search_fields()
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            sync_flags = bool(self.general_photo_one_id or self.general_photo_two_id)
+        else:
+            sync_flags = update_fields is None or bool(set(update_fields) & set(self.general_photo_fields))
+        if not self._state.adding and update_fields is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated and field.name not in self.maintained_fields
+            ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if sync_flags:
+                self.sync_general_photo_flags()
+
+    def clean(self):
+        super().clean()
+        selected = [getattr(self, f'{name}_id') for name in self.general_photo_fields]
+        selected = [photo_id for photo_id in selected if photo_id]
+        if selected and Item_Photos.objects.filter(pk__in=selected).exclude(item_id=self.pk).exists():
+            raise ValidationError('General photos must belong to the item.')
+
+    def sync_general_photo_flags(self):
+        """Mirror the general photo FKs into the `is_general_*` flags of the item's photos in one UPDATE."""
+        flags = {}
+        for name, flag in zip(self.general_photo_fields, ('is_general_one', 'is_general_two')):
+            photo_id = getattr(self, f'{name}_id')
+            flags[flag] = ExpressionWrapper(Q(pk=photo_id), output_field=models.BooleanField()) if photo_id else False
+        selected = [photo_id for photo_id in (self.general_photo_one_id, self.general_photo_two_id) if photo_id]
+        Item_Photos.objects.filter(item_id=self.pk).filter(
+            Q(is_general_one=True) | Q(is_general_two=True) | Q(pk__in=selected)
+        ).update(**flags)
+
+    @classmethod
+    def update_stock_totals(cls, *item_ids):
+        """Recompute `total_stock`/`is_in_stock` from the items' stock rows in one UPDATE."""
+        stocks = ItemStock.objects.filter(item=OuterRef('pk'))
+        totals = stocks.values('item').annotate(total=Sum('quantity')).values('total')
+        cls.objects.filter(pk__in=item_ids).update(
+            total_stock=Coalesce(Subquery(totals), 0, output_field=models.PositiveIntegerField()),
+            is_in_stock=Exists(stocks.filter(quantity__gt=0)),
+        )
+
+    def build_search_fields(self):
+        return (
+            normalize_search_text(self.name),
+            normalize_search_text(' '.join([self.brand, self.feature, self.description])),
+        )
 
     def __str__(self):
         return self.name
@@ -104,15 +185,17 @@ class Item(models.Model):
             ])
         )
 
-    def update_rating(self):
-        avg_rating = self.review.aggregate(average=Avg('grade'))['average']
-        self.rating = avg_rating if avg_rating else 0
-        self.save(update_fields=['rating'])
-
 
 class Photo(models.Model):
     name = models.CharField(max_length=100, unique=True)
     photo = models.ImageField(upload_to='item/', blank=True, default='default.png')
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Serves the admin autocomplete, which searches with `UPPER(name) LIKE UPPER('%term%')`.
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='photo_name_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -123,32 +206,7 @@ class Item_Photos(models.Model):
     photo = models.OneToOneField(Photo, on_delete=models.CASCADE,  related_name='item_photo')
     is_general_one = models.BooleanField(default=False)
     is_general_two = models.BooleanField(default=False)
-    _updating = False
 
-    def save(self, *args, **kwargs):
-        update_fields = kwargs.get('update_fields', None)
-
-        if not hasattr(self, '_updating'):
-            self._updating = True
-
-            if update_fields:
-                if 'is_general_one' in update_fields:
-                    if self.is_general_one:
-                        self.item.general_photo_one = self
-                    else:
-                        if self.item.general_photo_one == self:
-                            self.item.general_photo_one = None
-                    self.item.save(update_fields=['general_photo_one'])
-
-                if 'is_general_two' in update_fields:
-                    if self.is_general_two:
-                        self.item.general_photo_two = self
-                    else:
-                        if self.item.general_photo_two == self:
-                            self.item.general_photo_two = None
-                    self.item.save(update_fields=['general_photo_two'])
-
-        super(Item_Photos, self).save(*args, **kwargs)
     def __str__(self):
         return f'{self.item.name} - {self.photo.name}'
 
@@ -165,6 +223,10 @@ class Size(models.Model):
     def __str__(self):
         return self.name
 
+color_cache = catalog_cache.DimensionCache(Color)
+size_cache = catalog_cache.DimensionCache(Size)
+
+
 class ItemStock(models.Model):
     item = models.ForeignKey(Item, related_name='stocks', on_delete=models.CASCADE)
     color = models.ForeignKey(Color, on_delete=models.CASCADE, null=True, blank=True)
@@ -172,8 +234,162 @@ class ItemStock(models.Model):
     quantity = models.PositiveIntegerField(default=0)
     _deleting = False  # Внутренний флаг для предотвращения рекурсивного удаления
 
+    class Meta:
+        constraints = [
+            # One row per variant, so (item, color, size) resolves to a stock row with one index probe.
+            models.UniqueConstraint(fields=['item', 'color', 'size'], nulls_distinct=False,
+                                    name='item_stock_variant_unique'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keeps the row and the item's stock totals (see update_item_stock_totals) in one transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.item.name} - {color_cache.get(self.color_id)} - {size_cache.get(self.size_id)}"
+
+
+class ItemCard(models.Model):
+    """
+    Denormalized listing row, one per item, kept in sync by the signals below
+    so that a catalog page is served by a single indexed query. It backs the
+    `cards` listing and the recommendations; the `/api/items/` listing stays
+    on `Item` because its `populate` options return nested photos, categories
+    and stock the card only carries as display strings.
+    """
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    name = models.CharField(max_length=100)
+    price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    price_with_discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    rating = models.DecimalField(max_digits=2, decimal_places=1, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+    popularity = models.FloatField(default=0)
+    general_photo_one = models.CharField(max_length=255, blank=True)
+    general_photo_two = models.CharField(max_length=255, blank=True)
+    category_slugs = ArrayField(models.CharField(max_length=255), default=list, blank=True)
+    colors = models.JSONField(default=list, blank=True)
+    sizes = models.JSONField(default=list, blank=True)
+    total_stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['category_slugs'], name='item_card_categories_idx'),
+            models.Index(fields=['order_count', 'item'], name='item_card_order_count_idx'),
+            models.Index(fields=['price', 'item'], name='item_card_price_idx'),
+            models.Index(fields=['discount', 'item'], name='item_card_discount_idx'),
+            models.Index(fields=['price_with_discount'], name='item_card_pwd_idx'),
+            models.Index(fields=['popularity', 'item'], name='item_card_popularity_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def build(item):
+        """Build an unsaved card from an item with categories and stocks prefetched."""
+        colors, sizes = {}, {}
+        for stock in item.stocks.all():
+            if stock.color:
+                colors.setdefault(stock.color.name, {'name': stock.color.name, 'hex': stock.color.hex})
+            if stock.size:
+                sizes.setdefault(stock.size.name, {'name': stock.size.name})
+
+        def photo_url(item_photo):
+            if item_photo and item_photo.photo.photo:
+                return item_photo.photo.photo.url
+            return ''
+
+        return ItemCard(
+            item=item,
+            name=item.name,
+            price=item.price,
+            discount=item.discount,
+            price_with_discount=item.price_with_discount,
+            rating=item.rating,
+            order_count=item.order_count,
+            popularity=item.popularity,
+            general_photo_one=photo_url(item.general_photo_one),
+            general_photo_two=photo_url(item.general_photo_two),
+            category_slugs=[category.slug for category in item.categories.all()],
+            colors=list(colors.values()),
+            sizes=list(sizes.values()),
+            total_stock=sum(stock.quantity for stock in item.stocks.all()),
+        )
+
+
+class CategoryStats(models.Model):
+    """Per-category price bounds and counts, moved by the deltas of each item change (see apply_category_stats_change)."""
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    item_count = models.PositiveIntegerField(default=0)
+    in_stock_count = models.PositiveIntegerField(default=0)
+    discounted_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'Stats of {self.category_id}'
+
+
+class CatalogCounter(models.Model):
+    """
+    Catalog cache version counters and hit/miss counts (see api.cache), kept
+    in the database so that every web process and management command shares them.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    modified = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} = {self.value}'
+
+
+class ItemDailyViews(models.Model):
+    """Detail page views of an item per day, the view half of the popularity score."""
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'day'], name='item_daily_views_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.item_id} on {self.day}: {self.views}'
+
+
+class ItemCooccurrence(models.Model):
+    """
+    One non-zero cell of the item x item co-occurrence matrix: how many paid
+    orders contained both items. Stored in both directions.
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'other'], name='item_cooccurrence_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.item_id} x {self.other_id}: {self.count}'
+
+
+class ItemRecommendation(models.Model):
+    """The top-k co-occurring items of an item, strongest first, served by a primary key lookup."""
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='recommendation')
+    also_bought = ArrayField(models.PositiveIntegerField(), default=list)
+
     def __str__(self):
-        return f"{self.item.name} - {self.color.name} - {self.size.name}"
+        return f'Recommendations of {self.item_id}'
+
+
+def is_item_cascade(kwargs):
+    # Rows deleted together with their item need no per-item bookkeeping.
+    return isinstance(kwargs.get('origin'), Item)
 
 
 @receiver(post_delete, sender=Item_Photos)
@@ -181,35 +397,32 @@ def delete_orphaned_photos(sender, instance, **kwargs):
     if not Item_Photos.objects.filter(photo=instance.photo).exists():
         instance.photo.delete()
 
-@receiver(post_delete, sender=Item_Photos)
-def clear_item_general_photos(sender, instance, **kwargs):
-    if not instance.item:
-        return
-
-    if instance.item.general_photo_one == instance:
-        instance.item.general_photo_one = None
-        instance.item.save(update_fields=['general_photo_one'])
-
-    if instance.item.general_photo_two == instance:
-        instance.item.general_photo_two = None
-        instance.item.save(update_fields=['general_photo_two'])
-
 @receiver(post_delete, sender=Photo)
 def delete_photo_file(sender, instance, **kwargs):
-    instance.photo.delete(save=False)
+    images.schedule_delete(instance.photo)
 
 @receiver(post_delete, sender=Category)
 def delete_category_photo_file(sender, instance, **kwargs):
-    instance.photo.delete(save=False)
+    images.schedule_delete(instance.photo)
 
 @receiver(post_delete, sender=ItemStock)
 def delete_empty_item_stock(sender, instance, **kwargs):
     if instance.quantity == 0:
         instance.delete()
 
+@receiver(post_save, sender=ItemStock)
+def update_item_stock_totals_on_save(sender, instance, **kwargs):
+    update_item_stock_totals(instance.item_id)
+
+@receiver(post_delete, sender=ItemStock)
+def update_item_stock_totals_on_delete(sender, instance, **kwargs):
+    if not is_item_cascade(kwargs):
+        update_item_stock_totals(instance.item_id)
+
 @receiver(pre_save, sender=Photo)
 def delete_old_photo_file(sender, instance, **kwargs):
     if not instance.pk:
+        instance._photo_changed = True
         return False
 
     try:
@@ -217,12 +430,16 @@ def delete_old_photo_file(sender, instance, **kwargs):
     except Photo.DoesNotExist:
         return False
 
+    if old_instance.photo != instance.photo:
+        instance._photo_changed = True
+        instance.derivatives = {}
     if old_instance.photo and old_instance.photo != instance.photo:
-        old_instance.photo.delete(save=False)
+        images.schedule_delete(old_instance.photo)
 
 @receiver(pre_save, sender=Category)
 def delete_old_category_photo_file(sender, instance, **kwargs):
     if not instance.pk:
+        instance._photo_changed = True
         return False
 
     try:
@@ -230,33 +447,280 @@ def delete_old_category_photo_file(sender, instance, **kwargs):
     except Photo.DoesNotExist:
         return False
 
+    if old_instance.photo != instance.photo:
+        instance._photo_changed = True
+        instance.derivatives = {}
     if old_instance.photo and old_instance.photo != instance.photo:
-        old_instance.photo.delete(save=False)
+        images.schedule_delete(old_instance.photo)
+
+@receiver(post_save, sender=Photo)
+@receiver(post_save, sender=Category)
+def schedule_photo_derivatives(sender, instance, **kwargs):
+    if getattr(instance, '_photo_changed', False):
+        instance._photo_changed = False
+        images.schedule_derivatives(instance.photo.name)
+
+
+def refresh_item_cards(item_ids, stocks=None):
+    """
+    Rebuild the listing cards of the given items in a single upsert, from
+    `stocks` (an `ItemStock` queryset) when some rows must be left out.
+    """
+    stocks = ItemStock.objects.all() if stocks is None else stocks
+    items = Item.objects.filter(pk__in=set(item_ids)).select_related(
+        'general_photo_one__photo', 'general_photo_two__photo',
+    ).prefetch_related(
+        'categories',
+        Prefetch('stocks', queryset=stocks.select_related('color', 'size')),
+    )
+    cards = [ItemCard.build(item) for item in items]
+    if not cards:
+        return
+    ItemCard.objects.bulk_create(
+        cards,
+        update_conflicts=True,
+        unique_fields=['item'],
+        update_fields=[field.name for field in ItemCard._meta.concrete_fields if not field.primary_key],
+    )
 
-@receiver(pre_save, sender=Item)
-def update_item_general_photos_on_save(sender, instance, **kwargs):
-    with transaction.atomic():
-        old_instance = sender.objects.filter(pk=instance.pk).first()
 
-        if old_instance:
-            if not hasattr(old_instance, '_updating'):
-                old_instance._updating = True
+@receiver(post_save, sender=Item)
+def refresh_item_card_on_item_save(sender, instance, **kwargs):
+    refresh_item_cards([instance.pk])
 
-                if old_instance.general_photo_one != instance.general_photo_one:
-                    if old_instance.general_photo_one:
-                        old_instance.general_photo_one.is_general_one = False
-                        old_instance.general_photo_one.save(update_fields=['is_general_one'])
-                    if instance.general_photo_one:
-                        instance.general_photo_one.is_general_one = True
-                        instance.general_photo_one.save(update_fields=['is_general_one'])
+@receiver(post_save, sender=ItemStock)
+@receiver(post_save, sender=Item_Photos)
+def refresh_item_card_on_related_save(sender, instance, **kwargs):
+    refresh_item_cards([instance.item_id])
 
+@receiver(post_delete, sender=ItemStock)
+@receiver(post_delete, sender=Item_Photos)
+def refresh_item_card_on_related_delete(sender, instance, **kwargs):
+    # Stocks deleted with their color or size are refreshed once per dimension below.
+    if not is_item_cascade(kwargs) and not isinstance(kwargs.get('origin'), (Color, Size)):
+        refresh_item_cards([instance.item_id])
+
+@receiver(post_save, sender=Photo)
+def refresh_item_card_on_photo_save(sender, instance, **kwargs):
+    refresh_item_cards(Item_Photos.objects.filter(photo=instance).values_list('item_id', flat=True))
+
+def get_dimension_item_ids(instance):
+    """Ids of the items with stock in the given color or size."""
+    field = 'color' if isinstance(instance, Color) else 'size'
+    return list(ItemStock.objects.filter(**{f'{field}_id': instance.pk}).values_list('item_id', flat=True).distinct())
+
+@receiver(post_save, sender=Color)
+@receiver(post_save, sender=Size)
+def refresh_item_cards_on_dimension_save(sender, instance, created, **kwargs):
+    if not created:
+        refresh_item_cards(get_dimension_item_ids(instance))
+
+@receiver(pre_delete, sender=Color)
+@receiver(pre_delete, sender=Size)
+def remember_dimension_items(sender, instance, **kwargs):
+    instance._item_ids = get_dimension_item_ids(instance)
+
+@receiver(post_delete, sender=Color)
+@receiver(post_delete, sender=Size)
+def refresh_item_cards_on_dimension_delete(sender, instance, **kwargs):
+    # The cascaded stock rows may still be there: the collector does not order them before the dimension.
+    field = 'color' if sender is Color else 'size'
+    refresh_item_cards(getattr(instance, '_item_ids', []), ItemStock.objects.exclude(**{f'{field}_id': instance.pk}))
+
+@receiver(post_save, sender=Category)
+def refresh_item_cards_on_category_save(sender, instance, **kwargs):
+    refresh_item_cards(instance.items.values_list('id', flat=True))
 
-                if old_instance.general_photo_two != instance.general_photo_two:
-                    if old_instance.general_photo_two:
-                        old_instance.general_photo_two.is_general_two = False
-                        old_instance.general_photo_two.save(update_fields=['is_general_two'])
-                    if instance.general_photo_two:
-                        instance.general_photo_two.is_general_two = True
-                        instance.general_photo_two.save(update_fields=['is_general_two'])
+@receiver(post_delete, sender=Category)
+def refresh_item_cards_on_category_delete(sender, instance, **kwargs):
+    refresh_item_cards(ItemCard.objects.filter(category_slugs__contains=[instance.slug])
+                       .values_list('item_id', flat=True))
 
+@receiver(m2m_changed, sender=Item.categories.through)
+def refresh_item_cards_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        refresh_item_cards([instance.pk])
+    elif pk_set:
+        refresh_item_cards(pk_set)
+    else:
+        refresh_item_cards(ItemCard.objects.filter(category_slugs__contains=[instance.slug])
+                           .values_list('item_id', flat=True))
+
+
+def refresh_category_stats(category_ids):
+    """Recompute the stats of the given categories with one grouped query and one upsert."""
+    category_ids = set(category_ids)
+    if not category_ids:
+        return
+    rows = Item.categories.through.objects.filter(category_id__in=category_ids).values('category_id').annotate(
+        min_price=Min('item__price_with_discount'),
+        max_price=Max('item__price_with_discount'),
+        item_count=Count('item'),
+        in_stock_count=Count('item', filter=Q(item__is_in_stock=True)),
+        discounted_count=Count('item', filter=Q(item__discount__gt=0)),
+    )
+    stats = {category_id: CategoryStats(category_id=category_id) for category_id in category_ids}
+    for row in rows:
+        category_stats = stats[row.pop('category_id')]
+        for field, value in row.items():
+            setattr(category_stats, field, value)
+    existing = Category.objects.filter(pk__in=category_ids).values_list('pk', flat=True)
+    CategoryStats.objects.bulk_create(
+        [stats[category_id] for category_id in existing],
+        update_conflicts=True,
+        unique_fields=['category'],
+        update_fields=['min_price', 'max_price', 'item_count', 'in_stock_count', 'discounted_count'],
+    )
+
+
+def get_category_stats_state(item_id):
+    """
+    Lock the item row and return the part of it the category stats depend on,
+    `(price_with_discount, is discounted, is_in_stock)`, or `None` if it is gone.
+    """
+    row = Item.objects.select_for_update().filter(pk=item_id).values_list(
+        'price_with_discount', 'discount', 'is_in_stock').first()
+    if row is None:
+        return None
+    price, discount, is_in_stock = row
+    return price, discount > 0, is_in_stock
+
+
+def apply_category_stats_change(category_ids, old, new):
+    """
+    Move the stats of the given categories from one item state to another
+    (`None` when the item is not in them) with F() deltas instead of a
+    recount. The price bounds only widen here; they are recomputed, for the
+    categories whose bound was the old price, when that price leaves.
+    """
+    category_ids = set(category_ids)
+    if not category_ids or old == new:
+        return
+    old_price, new_price = (old or (None,))[0], (new or (None,))[0]
+    deltas = {
+        'item_count': (new is not None) - (old is not None),
+        'discounted_count': bool(new and new[1]) - bool(old and old[1]),
+        'in_stock_count': bool(new and new[2]) - bool(old and old[2]),
+    }
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if new_price is not None and new_price != old_price:
+        # LEAST/GREATEST skip NULL, so an empty category takes the new price as both bounds.
+        updates['min_price'] = Least('min_price', Value(new_price))
+        updates['max_price'] = Greatest('max_price', Value(new_price))
+    stats = CategoryStats.objects.filter(category_id__in=category_ids)
+    if updates:
+        stats.update(**updates)
+
+    if old_price is not None and old_price != new_price:
+        prices = Item.categories.through.objects.filter(category_id=OuterRef('category_id')).values('category_id')
+        stats.filter(Q(min_price=old_price) | Q(max_price=old_price)).update(
+            min_price=Subquery(prices.annotate(value=Min('item__price_with_discount')).values('value')),
+            max_price=Subquery(prices.annotate(value=Max('item__price_with_discount')).values('value')),
+        )
+
+
+def update_item_stock_totals(item_id):
+    """
+    Recompute the item's stock totals and, when that flips `is_in_stock`,
+    move it between the in-stock counts of its categories. The item row is
+    locked first, so concurrent stock changes of one item apply in turn.
+    """
+    old = get_category_stats_state(item_id)
+    Item.update_stock_totals(item_id)
+    if old is None:
+        return
+    is_in_stock = Item.objects.filter(pk=item_id).values_list('is_in_stock', flat=True).get()
+    if is_in_stock != old[2]:
+        apply_category_stats_change(
+            Item.categories.through.objects.filter(item_id=item_id).values_list('category_id', flat=True),
+            old, old[:2] + (is_in_stock,),
+        )
+
+
+def changes_category_stats(instance, update_fields):
+    return not instance._state.adding and (
+        update_fields is None or bool({'price', 'discount', 'price_with_discount'} & set(update_fields)))
 
+@receiver(pre_save, sender=Item)
+def remember_item_stats_state(sender, instance, update_fields=None, **kwargs):
+    if changes_category_stats(instance, update_fields):
+        instance._stats_state = get_category_stats_state(instance.pk)
+
+@receiver(post_save, sender=Item)
+def update_category_stats_on_item_save(sender, instance, created, **kwargs):
+    old = instance.__dict__.pop('_stats_state', None)
+    if created or old is None:
+        return
+    price = Decimal(instance.price_with_discount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    # Item.save never writes is_in_stock, so only the price and the discount can have moved.
+    new = (price, instance.discount > 0, old[2])
+    if new != old:
+        apply_category_stats_change(
+            Item.categories.through.objects.filter(item_id=instance.pk).values_list('category_id', flat=True),
+            old, new,
+        )
+
+@receiver(pre_delete, sender=Item)
+def remember_item_categories(sender, instance, **kwargs):
+    instance._category_ids = list(instance.categories.values_list('pk', flat=True))
+    instance._stats_state = get_category_stats_state(instance.pk)
+
+@receiver(post_delete, sender=Item)
+def update_category_stats_on_item_delete(sender, instance, **kwargs):
+    apply_category_stats_change(getattr(instance, '_category_ids', []), getattr(instance, '_stats_state', None), None)
+
+@receiver(post_save, sender=Category)
+def create_category_stats(sender, instance, created, **kwargs):
+    if created:
+        refresh_category_stats([instance.pk])
+
+@receiver(m2m_changed, sender=Item.categories.through)
+def update_category_stats_on_categories_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # Bulk edits of one category's items; a single recount of that category.
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_category_stats([instance.pk])
+        return
+    links = Item.categories.through.objects.filter(item_id=instance.pk)
+    if action == 'pre_remove':
+        # remove() passes the requested ids, linked or not.
+        instance._category_ids = list(links.filter(category_id__in=pk_set).values_list('category_id', flat=True))
+    elif action == 'pre_clear':
+        instance._category_ids = list(links.values_list('category_id', flat=True))
+    elif action == 'post_add':
+        # add() passes only the ids it actually linked.
+        apply_category_stats_change(pk_set, None, get_category_stats_state(instance.pk))
+    elif action in ('post_remove', 'post_clear'):
+        apply_category_stats_change(instance.__dict__.pop('_category_ids', []),
+                                    get_category_stats_state(instance.pk), None)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=ItemStock)
+@receiver(post_save, sender=Item_Photos)
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=ItemStock)
+@receiver(post_delete, sender=Item_Photos)
+@receiver(post_delete, sender=Photo)
+def bump_items_cache_version(sender, **kwargs):
+    catalog_cache.bump_version(catalog_cache.ITEMS)
+
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Item.categories.through)
+def bump_catalog_cache_version(sender, **kwargs):
+    catalog_cache.bump_version(catalog_cache.ITEMS, catalog_cache.CATEGORIES)
+
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+def invalidate_dimension_cache(sender, **kwargs):
+    dimension_cache = color_cache if sender is Color else size_cache
+    dimension_cache.invalidate()
+    # Reset again after commit, when the version is bumped, so no thread keeps rows read before then.
+    transaction.on_commit(dimension_cache.invalidate)
+    catalog_cache.bump_version(catalog_cache.ITEMS)
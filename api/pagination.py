@@ -1,6 +1,169 @@
-from django.core.paginator import InvalidPage
+import json
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from django.core.paginator import InvalidPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+Cursor = namedtuple('Cursor', ['position', 'reverse'])
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder cuts datetimes to milliseconds, and a truncated
+        # position makes the seek repeat or skip rows within that millisecond.
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Cursor pagination that seeks by the values of the queryset ordering
+    instead of using OFFSET, so every page costs the same regardless of depth.
+    The last ordering field must be unique (e.g. `id`) to keep the order stable.
+    The total count is only computed when `with_count` is passed.
+    """
+    page_size = 10
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        # The seek filter assumes exactly this order, including the appended tiebreaker.
+        queryset = queryset.order_by(*self.ordering)
+        self.count = None
+
+        cursor = self.decode_cursor(request)
+        if request.query_params.get(self.count_query_param):
+            self.count = queryset.count()
+
+        if cursor is not None:
+            queryset = queryset.filter(self.get_seek_filter(cursor))
+        if cursor is not None and cursor.reverse:
+            queryset = queryset.reverse()
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if cursor is not None and cursor.reverse:
+            self.page.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_previous = cursor is not None
+            self.has_next = has_more
+
+        if self.page:
+            self.next_position = self.get_position(self.page[-1])
+            self.previous_position = self.get_position(self.page[0])
+        else:
+            self.next_position = self.previous_position = cursor.position if cursor else None
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response['count'] = self.count
+        return Response(response)
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+                if page_size > 0:
+                    return min(page_size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, queryset):
+        """
+        The queryset's ordering (or its model's default) ending with `id`: the
+        cursor is the last row's values of these fields, so they must be unique
+        together, or rows sharing them would be skipped or repeated across pages.
+        """
+        ordering = tuple(queryset.query.order_by)
+        if not ordering and queryset.query.default_ordering:
+            ordering = tuple(queryset.model._meta.ordering)
+        if not all(isinstance(field, str) for field in ordering):
+            raise TypeError('Keyset pagination needs an ordering by field names')
+        if not ordering or ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering += ('id',)
+        return ordering
+
+    def get_position(self, instance):
+        return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+    def get_seek_filter(self, cursor):
+        """
+        Build `(a, b) > (x, y)` as `a > x OR (a = x AND b > y)`, flipping the
+        comparison for descending fields and for backwards navigation.
+        """
+        seek = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, cursor.position):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != cursor.reverse
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            seek |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return seek
+
+    def get_next_link(self):
+        if not self.has_next or self.next_position is None:
+            return None
+        return self.encode_cursor(Cursor(position=self.next_position, reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous or self.previous_position is None:
+            return None
+        return self.encode_cursor(Cursor(position=self.previous_position, reverse=True))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            payload = json.loads(b64decode(encoded.encode('ascii'), altchars=b'-_'))
+            ordering = tuple(payload['o'])
+            position = list(payload['p'])
+            reverse = bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if ordering != self.ordering or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(position=position, reverse=reverse)
+
+    def encode_cursor(self, cursor):
+        payload = {'o': self.ordering, 'p': cursor.position}
+        if cursor.reverse:
+            payload['r'] = 1
+        data = json.dumps(payload, cls=CursorEncoder, separators=(',', ':'))
+        encoded = b64encode(data.encode('utf-8'), altchars=b'-_').decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
 
 
 class CustomPagination(pagination.PageNumberPagination):
@@ -8,13 +171,21 @@ class CustomPagination(pagination.PageNumberPagination):
     page_size_query_param = 'limit'
     max_page_size = 100
     page_query_param = 'page'
+    cursor_pagination_class = KeysetPagination
 
     def paginate_queryset(self, queryset, request, view=None):
         """
         Paginate a queryset if required, either returning a
         page object, or `None` if pagination is not configured for this view.
+        Requests carrying a `cursor` parameter (even an empty one for the first
+        page) are served by the keyset paginator instead.
         """
         self.request = request
+        self.cursor_paginator = None
+        if self.cursor_pagination_class.cursor_query_param in request.query_params:
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+
         page_size = self.get_page_size(request)
         if not page_size:
             return None
@@ -37,4 +208,51 @@ class CustomPagination(pagination.PageNumberPagination):
         return list(self.page)
 
     def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
         return Response(data)
+
+
+class KeysetLimitOffsetPagination(pagination.LimitOffsetPagination):
+    """
+    Limit/offset pagination that hands requests carrying a `cursor` parameter
+    (even an empty one for the first page) to the keyset paginator.
+    """
+    cursor_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_pagination_class.cursor_query_param in request.query_params:
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin changelist paginator that takes the row count of an unfiltered
+    table from the planner statistics in `pg_class` instead of a COUNT(*)
+    over the whole table. Filtered, small or never analyzed tables are
+    still counted exactly.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and not queryset.query.distinct:
+            connection = connections[queryset.db]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [connection.ops.quote_name(queryset.model._meta.db_table)],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.exact_count_threshold:
+                return int(row[0])
+        return super().count
@@ -0,0 +1,91 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = Counter()
+_timer = None
+
+
+def decay(age_days):
+    """Weight of an event `age_days` old: it halves every `POPULARITY_HALF_LIFE_DAYS`."""
+    return 0.5 ** (max(age_days, 0) / settings.POPULARITY_HALF_LIFE_DAYS)
+
+
+def record_view(item_id):
+    """
+    Count a detail page view in memory; the buffer is written out as one
+    batch every `POPULARITY_VIEW_FLUSH_SIZE` views, or by a timer started
+    with the first buffered view, so a page view never waits for an UPDATE
+    of a hot row and an idle process still writes its views within
+    `POPULARITY_VIEW_FLUSH_INTERVAL` seconds.
+    """
+    global _timer
+    with _lock:
+        _pending[item_id] += 1
+        if sum(_pending.values()) < settings.POPULARITY_VIEW_FLUSH_SIZE:
+            if _timer is None:
+                _timer = threading.Timer(settings.POPULARITY_VIEW_FLUSH_INTERVAL, flush_pending_views)
+                _timer.daemon = True
+                _timer.start()
+            return
+        pending = _take_pending()
+    flush_views(pending)
+
+
+def _take_pending():
+    """Empty the buffer and stop its timer; the caller holds `_lock`."""
+    global _timer
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+    pending = _pending.copy()
+    _pending.clear()
+    return pending
+
+
+def flush_pending_views():
+    """Timer and exit hook: write the buffer out on a connection of its own thread."""
+    try:
+        flush_views()
+    except Exception:
+        logger.exception('Cannot write buffered item views')
+    finally:
+        connection.close()
+
+
+atexit.register(flush_pending_views)
+
+
+def flush_views(pending=None):
+    """Add buffered views to today's `ItemDailyViews` rows; returns the number of views written."""
+    from api.models import Item, ItemDailyViews
+
+    if pending is None:
+        with _lock:
+            pending = _take_pending()
+    if not pending:
+        return 0
+
+    today = timezone.localdate()
+    existing = set(Item.objects.filter(pk__in=pending).values_list('pk', flat=True))
+    with transaction.atomic():
+        ItemDailyViews.objects.bulk_create(
+            [ItemDailyViews(item_id=item_id, day=today) for item_id in sorted(existing)],
+            ignore_conflicts=True,
+        )
+        # Items sharing a view count share one UPDATE.
+        by_count = {}
+        for item_id in existing:
+            by_count.setdefault(pending[item_id], []).append(item_id)
+        for count, item_ids in by_count.items():
+            ItemDailyViews.objects.filter(item_id__in=item_ids, day=today).update(views=F('views') + count)
+    return sum(pending[item_id] for item_id in existing)
@@ -1,29 +1,65 @@
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 
-from .models import Item, Category, Photo, Item_Photos, Color, Size, ItemStock
+from . import images
+from .models import Item, Category, Photo, Item_Photos, Color, Size, ItemStock, ItemCard, CategoryStats
+
+
+class CategoryStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CategoryStats
+        exclude = ['category']
 
 
 class CategorySerializer(serializers.ModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name='category-detail', lookup_field='slug')
     items_url = serializers.SerializerMethodField()
     item_count = serializers.SerializerMethodField()
+    stats = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
-        fields = '__all__'
+        exclude = ['derivatives']
 
 
     def get_items_url(self, obj):
+        # One absolute URI per serializer; with many=True the child serializer is shared by every row.
+        if not hasattr(self, '_categories_url'):
+            request = self.context.get('request')
+            self._categories_url = request.build_absolute_uri('/api/categories/')
+        return f'{self._categories_url}{obj.slug}/items/'
+
+    def get_srcset(self, obj):
         request = self.context.get('request')
-        return request.build_absolute_uri(f'/api/categories/{obj.slug}/items/')
+        return images.get_srcset(obj.photo.name, obj.derivatives, request.build_absolute_uri if request else None)
+
+    def get_stats(self, obj):
+        try:
+            return CategoryStatsSerializer(obj.stats).data
+        except CategoryStats.DoesNotExist:
+            return None
 
     def get_item_count(self, obj):
+        if hasattr(obj, 'item_count'):
+            return obj.item_count
         return obj.items.count()
 
+class CategoryTreeSerializer(CategorySerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug', 'photo', 'srcset', 'item_count', 'items_url']
+
 class PhotoSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = Photo
-        fields = '__all__'
+        exclude = ['derivatives']
+
+    def get_srcset(self, obj):
+        request = self.context.get('request')
+        return images.get_srcset(obj.photo.name, obj.derivatives, request.build_absolute_uri if request else None)
 
 class ColorSerializer(serializers.ModelSerializer):
     class Meta:
@@ -44,7 +80,7 @@ class ItemPhotoSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class StockItemSerializer(serializers.ModelSerializer):
-    item_id = serializers.IntegerField(source='item.id')
+    item_id = serializers.IntegerField()
     color = serializers.CharField(source='color.name')
     hex = serializers.CharField(source='color.hex')
     size = serializers.CharField(source='size.name')
@@ -53,46 +89,140 @@ class StockItemSerializer(serializers.ModelSerializer):
         model = ItemStock
         fields = ['item_id', 'color', 'hex', 'size', 'quantity']
 
+class ItemCardSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='item_id')
+
+    class Meta:
+        model = ItemCard
+        exclude = ['item']
+
+def get_populate(context):
+    request = context.get('request', None)
+    return request.query_params.get('populate', '').split(',') if request else []
+
+def get_sparse_fields(context):
+    """
+    The `fields`/`omit` query parameters as `(fields, omit)` sets;
+    `fields` is `None` when every field is wanted.
+    """
+    request = context.get('request', None)
+    if request is None:
+        return None, set()
+
+    def parse(param):
+        value = request.query_params.get(param)
+        return {name for name in value.split(',') if name} if value else None
+
+    return parse('fields'), parse('omit') or set()
+
+class ItemListSerializer(serializers.ListSerializer):
+    """
+    Resolves the relations requested via `populate` for the whole page with
+    `prefetch_related_objects`, so a page costs a constant number of queries.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        prefetch_related_objects(items, *self.child.get_prefetch_lookups())
+        return [self.child.to_representation(item) for item in items]
+
 class ItemSerializer(serializers.ModelSerializer):
     colors = ColorSerializer(many=True, read_only=True)
     sizes = SizeSerializer(many=True, read_only=True)
     class Meta:
         model = Item
-        fields = '__all__'
+        exclude = ['search_name', 'search_document', 'search_vector']
+        list_serializer_class = ItemListSerializer
+
+    @classmethod
+    def get_deferred_fields(cls, context, keep=()):
+        """
+        Item columns that nothing in the response reads: the search columns,
+        which are never serialized, and every field trimmed away by `fields`/`omit`.
+        `keep` protects columns needed elsewhere, such as the ordering.
+        """
+        fields, omit = get_sparse_fields(context)
+        deferred = list(cls.Meta.exclude)
+        for field in Item._meta.concrete_fields:
+            if field.primary_key or field.name in keep or field.name in deferred:
+                continue
+            if (fields is not None and field.name not in fields) or field.name in omit:
+                deferred.append(field.name)
+        return deferred
+
+    def is_requested(self, name):
+        if name == 'id':
+            return True
+        # Parsed once per serializer; with many=True the child serializer is shared by every row.
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = get_sparse_fields(self.context)
+        fields, omit = self._sparse_fields
+        return (fields is None or name in fields) and name not in omit
+
+    def get_fields(self):
+        fields = super().get_fields()
+        return {name: field for name, field in fields.items() if self.is_requested(name)}
+
+    def get_prefetch_lookups(self):
+        populate = get_populate(self.context)
+        lookups = []
+
+        if 'all_photo' in populate:
+            if self.is_requested('all_photo'):
+                lookups.append('item_photos__photo')
+        elif self.is_requested('all_photos'):
+            lookups.append('item_photos')
+
+        if self.is_requested('categories'):
+            if 'categories' in populate:
+                lookups.append(Prefetch('categories', queryset=Category.objects.with_item_count().select_related('stats')))
+            else:
+                lookups.append('categories')
+
+        if 'general_photos' in populate:
+            lookups += [f'{name}__photo' for name in ('general_photo_one', 'general_photo_two')
+                        if self.is_requested(name)]
+
+        if 'colors_sizes' in populate and (self.is_requested('colors') or self.is_requested('sizes')):
+            lookups.append(Prefetch('stocks', queryset=ItemStock.objects.select_related('color', 'size').order_by('pk')))
+
+        return lookups
 
+    # Deduplicated in stock order rather than through a set, whose string order differs per process
+    # and would change the body (and the ETag) of identical data between workers.
     def get_colors(self, instance):
-        colors = instance.stocks.values('color__name', 'color__hex').distinct()
-        return [{'name': color['color__name'], 'hex': color['color__hex']} for color in colors]
+        colors = dict.fromkeys((stock.color.name, stock.color.hex) if stock.color else (None, None)
+                               for stock in instance.stocks.all())
+        return [{'name': name, 'hex': hex} for name, hex in colors]
 
     def get_sizes(self, instance):
-        sizes = instance.stocks.values('size__name').distinct()
-        return [{'name': size['size__name']} for size in sizes]
+        sizes = dict.fromkeys(stock.size.name if stock.size else None for stock in instance.stocks.all())
+        return [{'name': name} for name in sizes]
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         request = self.context.get('request', None)
-        populate = request.query_params.get('populate', '').split(',') if request else []
+        populate = get_populate(self.context)
 
         if 'all_photo' in populate:
-            representation['all_photo'] = ItemPhotoSerializer(instance.item_photos.all(), many=True).data
-        else:
-            representation['all_photos'] = list(instance.item_photos.values_list('id', flat=True))
+            if self.is_requested('all_photo'):
+                representation['all_photo'] = ItemPhotoSerializer(instance.item_photos.all(), many=True).data
+        elif self.is_requested('all_photos'):
+            representation['all_photos'] = [item_photo.pk for item_photo in instance.item_photos.all()]
 
         if 'general_photos' in populate:
-            representation['general_photo_one'] = ItemPhotoSerializer(
-                instance.general_photo_one).data if instance.general_photo_one else None
-            representation['general_photo_two'] = ItemPhotoSerializer(
-                instance.general_photo_two).data if instance.general_photo_two else None
+            for name in ('general_photo_one', 'general_photo_two'):
+                if self.is_requested(name):
+                    item_photo = getattr(instance, name)
+                    representation[name] = ItemPhotoSerializer(item_photo).data if item_photo else None
 
-        if 'categories' in populate:
+        if 'categories' in populate and self.is_requested('categories'):
             representation['categories'] = CategorySerializer(instance.categories.all(), many=True,
                                                               context={'request': request}).data
 
-        if 'colors_sizes' in populate:
-            representation['colors'] = self.get_colors(instance)
-            representation['sizes'] = self.get_sizes(instance)
-        else:
-            representation['colors'] = []
-            representation['sizes'] = []
+        if self.is_requested('colors'):
+            representation['colors'] = self.get_colors(instance) if 'colors_sizes' in populate else []
+        if self.is_requested('sizes'):
+            representation['sizes'] = self.get_sizes(instance) if 'colors_sizes' in populate else []
 
         return representation
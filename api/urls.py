@@ -3,7 +3,8 @@ from rest_framework.routers import DefaultRouter
 
 from rest_framework_nested.routers import NestedDefaultRouter
 
-from api.views import ItemViewSet, CategoryViewSet, PhotoViewSet, ItemDetail, StockItemView
+from api.views import ItemViewSet, CategoryViewSet, PhotoViewSet, StockItemView, StockItemsView, \
+    CatalogCacheStatsView, CatalogExportView
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet)
@@ -17,10 +18,13 @@ urlpatterns = [
     path('', include(router.urls)),
     path('', include(categories_router.urls)),
     path('stock_item/<int:item_id>/', StockItemView.as_view(), name='stock-item-detail'),
+    path('stock_items/', StockItemsView.as_view(), name='stock-items'),
     path('items/max_price/', ItemViewSet.as_view({'get': 'max_price'}), name='item-max-price'),
+    path('items/min_price/', ItemViewSet.as_view({'get': 'min_price'}), name='item-min-price'),
+    path('cache_stats/', CatalogCacheStatsView.as_view(), name='catalog-cache-stats'),
+    path('catalog_export/', CatalogExportView.as_view(), name='catalog-export'),
 ]
 
 urlpatterns += [
     path('categories/<slug:slug>/', CategoryViewSet.as_view({'get': 'retrieve'}), name='category-detail'),
-    path('categories/<str:category_slug>/items/<int:item_id>/', ItemDetail.as_view(), name='item-detail'),
 ]
\ No newline at end of file
@@ -1,14 +1,28 @@
-from django.db.models import Max
+import csv
+import json
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Min, Q, F, Count, Value, CharField, DecimalField, Prefetch
+from django.db.models.functions import Cast
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets, generics
 import logging
 
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from api.models import Item, Category, Photo, ItemStock
+from api import cache as catalog_cache, popularity
+from api.cache import cached_response, conditional_response, ITEMS, CATEGORIES
+from api.models import Item, Category, Photo, ItemStock, ItemCard, CategoryStats, ItemRecommendation, \
+    normalize_search_text, color_cache, size_cache
 from api.pagination import CustomPagination
-from api.serializers import ItemSerializer, CategorySerializer, PhotoSerializer, StockItemSerializer
+from api.serializers import ItemSerializer, CategorySerializer, PhotoSerializer, StockItemSerializer, \
+    ItemCardSerializer, CategoryTreeSerializer
 
 logger = logging.getLogger(__name__)
 
@@ -17,18 +31,37 @@ class ItemViewSet(viewsets.ModelViewSet):
     serializer_class = ItemSerializer
     pagination_class = CustomPagination
     permission_classes = (AllowAny,)
+    sort_orderings = {
+        'discount': ('-discount', '-pk'),
+        'price_asc': ('price', 'pk'),
+        'price_desc': ('-price', '-pk'),
+        'popular': ('-popularity', '-pk'),
+        'bestsellers': ('-order_count', '-pk'),
+    }
+    default_ordering = sort_orderings['popular']
+    price_buckets = (1000, 3000, 5000, 10000)
+    price_filter_params = ('min_price', 'max_price', 'with_discount', 'in_stock')
 
     def get_queryset(self):
-        queryset = self.queryset
         category_slug = self.kwargs.get('category_slug')
+        in_stock = self.request.query_params.get('in_stock')
 
-        if category_slug:
-            queryset = queryset.filter(categories__slug=category_slug)
+        if self.action == 'cards':
+            queryset = ItemCard.objects.all()
+            if category_slug:
+                queryset = queryset.filter(category_slugs__contains=[category_slug])
+            if in_stock:
+                queryset = queryset.filter(total_stock__gt=0)
+        else:
+            queryset = self.queryset
+            if category_slug:
+                queryset = queryset.filter(categories__slug=category_slug)
+            if in_stock:
+                queryset = queryset.filter(is_in_stock=True)
 
         min_price = self.request.query_params.get('min_price')
         max_price = self.request.query_params.get('max_price')
         with_discount = self.request.query_params.get('with_discount')
-        in_stock = self.request.query_params.get('in_stock')
         sort = self.request.query_params.get('sort')
 
         if min_price is not None:
@@ -40,36 +73,21 @@ class ItemViewSet(viewsets.ModelViewSet):
         if with_discount:
             queryset = queryset.filter(discount__gt=0)
 
-        if in_stock:
-            queryset = queryset.filter(stocks__quantity__gt=0).distinct()
-
-        if sort:
-            if sort == 'discount':
-                queryset = queryset.order_by('-discount')
-            elif sort == 'price_asc':
-                queryset = queryset.order_by('price')
-            elif sort == 'price_desc':
-                queryset = queryset.order_by('-price')
-        else:
-            queryset = queryset.order_by('-order_count')
+        queryset = queryset.order_by(*self.sort_orderings.get(sort, self.default_ordering))
 
+        if self.action == 'retrieve':
+            queryset = queryset.defer(*ItemSerializer.get_deferred_fields(self.get_serializer_context()))
         return queryset
 
-    def list(self, request, *args, **kwargs):
-        populate = request.query_params.get('populate', '').split(',')
-        queryset = self.get_queryset()
+    def defer_unrequested_fields(self, queryset):
+        # Ordering columns stay loaded: keyset pagination reads them from the last row.
+        keep = {field.lstrip('-') for field in queryset.query.order_by}
+        return queryset.defer(*ItemSerializer.get_deferred_fields(self.get_serializer_context(), keep))
 
-        if populate:
-            if 'all_photo' in populate:
-                queryset = queryset.prefetch_related('item_photos__photo')
-            if 'general_photos' in populate:
-                queryset = queryset.prefetch_related('general_photo_one__photo', 'general_photo_two__photo')
-            if 'categories' in populate:
-                queryset = queryset.prefetch_related('categories')
-            if 'colors_sizes' in populate:
-                queryset = queryset.prefetch_related('stocks__color', 'stocks__size')
-
-        page = self.paginate_queryset(queryset)
+    @cached_response(ITEMS, CATEGORIES)
+    def list(self, request, *args, **kwargs):
+        # Relations requested via `populate` are batched per page by ItemListSerializer.
+        page = self.paginate_queryset(self.defer_unrequested_fields(self.get_queryset()))
         if page is not None:
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
@@ -77,57 +95,290 @@ class ItemViewSet(viewsets.ModelViewSet):
         # serializer = self.get_serializer(queryset, many=True)
         return Response([])
 
+    def retrieve(self, request, *args, **kwargs):
+        # Counted before the cache so cached responses and 304s are views too; unknown ids are dropped
+        # when the buffer is flushed (see api.popularity).
+        if str(kwargs['pk']).isdigit():
+            popularity.record_view(int(kwargs['pk']))
+        return self.cached_retrieve(request, *args, **kwargs)
+
+    @cached_response(ITEMS, CATEGORIES)
+    def cached_retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=False, methods=['get'])
-    def max_price(self, request, *args, **kwargs):
+    @cached_response(ITEMS)
+    def cards(self, request, *args, **kwargs):
+        """Listing served from the denormalized `ItemCard` read model."""
+        page = self.paginate_queryset(self.get_queryset())
+        if page is not None:
+            serializer = ItemCardSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response([])
+
+    @action(detail=True, methods=['get'])
+    @cached_response(ITEMS)
+    def also_bought(self, request, *args, **kwargs):
+        """Cards of the items most often bought together with this one, strongest first."""
+        item_id = str(kwargs['pk'])
+        if not item_id.isdigit():
+            raise NotFound()
+        neighbour_ids = ItemRecommendation.objects.filter(item_id=item_id).values_list(
+            'also_bought', flat=True).first() or []
+        cards = ItemCard.objects.in_bulk(neighbour_ids)
+        serializer = ItemCardSerializer([cards[pk] for pk in neighbour_ids if pk in cards], many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    @cached_response(ITEMS, CATEGORIES)
+    def search(self, request, *args, **kwargs):
+        """
+        Ranked full-text search with prefix matching over the transliterated
+        name, brand, feature and description, falling back to trigram word
+        similarity on the name for typos. The list filters still apply.
+        """
+        query = normalize_search_text(request.query_params.get('q', ''))
+        terms = re.findall(r'\w+', query)
+        queryset = self.get_queryset()
+
+        if terms:
+            search_query = SearchQuery(' & '.join(f'{term}:*' for term in terms),
+                                       search_type='raw', config='simple')
+            queryset = queryset.filter(
+                Q(search_vector=search_query) | Q(search_name__trigram_word_similar=query)
+            ).annotate(
+                # A real (float4) rank comes back from the cursor as a float8 that never equals it again,
+                # so the keyset seek would repeat rows; a fixed scale numeric round-trips exactly.
+                rank=Cast(SearchRank(F('search_vector'), search_query) + TrigramWordSimilarity(query, 'search_name'),
+                          DecimalField(max_digits=12, decimal_places=6))
+            ).order_by('-rank', '-pk')
+        else:
+            queryset = queryset.none()
+
+        page = self.paginate_queryset(self.defer_unrequested_fields(queryset))
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response([])
+
+    @action(detail=False, methods=['get'])
+    @cached_response(ITEMS, CATEGORIES)
+    def facets(self, request, *args, **kwargs):
+        """
+        Filter sidebar counts for the current filter set: one aggregate query
+        over the items and one UNION ALL of the grouped color/size/category counts.
+        """
+        queryset = self.get_queryset().order_by()
+        bounds = (0,) + self.price_buckets + (None,)
+        buckets = list(zip(bounds, bounds[1:]))
+
+        aggregates = {
+            'total': Count('pk'),
+            'with_discount': Count('pk', filter=Q(discount__gt=0)),
+        }
+        for index, (low, high) in enumerate(buckets):
+            price_filter = Q(price_with_discount__gte=low)
+            if high is not None:
+                price_filter &= Q(price_with_discount__lt=high)
+            aggregates[f'price_{index}'] = Count('pk', filter=price_filter)
+        counts = queryset.aggregate(**aggregates)
+
+        item_ids = queryset.values('pk')
+        groups = [
+            ItemStock.objects.filter(item__in=item_ids, color__isnull=False).values(
+                facet=Value('colors', output_field=CharField()), value=F('color__name'), label=F('color__hex')),
+            ItemStock.objects.filter(item__in=item_ids, size__isnull=False).values(
+                facet=Value('sizes', output_field=CharField()), value=F('size__name'), label=F('size__name')),
+            Item.categories.through.objects.filter(item__in=item_ids).values(
+                facet=Value('categories', output_field=CharField()), value=F('category__slug'),
+                label=F('category__name')),
+        ]
+        groups = [group.annotate(count=Count('item', distinct=True)) for group in groups]
+
+        facets = {'colors': [], 'sizes': [], 'categories': []}
+        for row in groups[0].union(*groups[1:], all=True):
+            if row['facet'] == 'colors':
+                facets['colors'].append({'name': row['value'], 'hex': row['label'], 'count': row['count']})
+            elif row['facet'] == 'sizes':
+                facets['sizes'].append({'name': row['value'], 'count': row['count']})
+            else:
+                facets['categories'].append({'slug': row['value'], 'name': row['label'], 'count': row['count']})
+
+        return Response({
+            'total': counts['total'],
+            'discount': {
+                'with_discount': counts['with_discount'],
+                'without_discount': counts['total'] - counts['with_discount'],
+            },
+            'price': [
+                {'min': low, 'max': high, 'count': counts[f'price_{index}']}
+                for index, (low, high) in enumerate(buckets)
+            ],
+            **facets,
+        })
+
+    def get_price_bound(self, bound, aggregate):
+        """
+        Unfiltered category bounds come from `CategoryStats` in O(1); anything
+        else aggregates over the filtered queryset (index-backed without filters).
+        """
+        category_slug = self.kwargs.get('category_slug')
+        filtered = any(param in self.request.query_params for param in self.price_filter_params)
+        if category_slug and not filtered:
+            return CategoryStats.objects.filter(category__slug=category_slug).values_list(bound, flat=True).first()
+
         queryset = self.filter_queryset(self.get_queryset())
-        max_price = queryset.aggregate(Max('price_with_discount'))['price_with_discount__max']
-        return Response({'max_price': max_price})
+        return queryset.aggregate(value=aggregate('price_with_discount'))['value']
+
+    @action(detail=False, methods=['get'])
+    @cached_response(ITEMS, CATEGORIES)
+    def max_price(self, request, *args, **kwargs):
+        return Response({'max_price': self.get_price_bound('max_price', Max)})
+
+    @action(detail=False, methods=['get'])
+    @cached_response(ITEMS, CATEGORIES)
+    def min_price(self, request, *args, **kwargs):
+        return Response({'min_price': self.get_price_bound('min_price', Min)})
 
 class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+    queryset = Category.objects.with_item_count().select_related('stats')
     serializer_class = CategorySerializer
     lookup_field = 'slug'
 
+    # The embedded stats follow item prices and stock, hence the ITEMS scope.
+    @cached_response(CATEGORIES, ITEMS)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response(CATEGORIES, ITEMS)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    @cached_response(CATEGORIES)
+    def tree(self, request, *args, **kwargs):
+        """All categories with photos and item counts, rebuilt only when categories or their items change."""
+        queryset = Category.objects.with_item_count().order_by('name')
+        serializer = CategoryTreeSerializer(queryset, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+
 class PhotoViewSet(viewsets.ModelViewSet):
     queryset = Photo.objects.all()
     serializer_class = PhotoSerializer
 
-class ItemDetail(generics.RetrieveAPIView):
-    serializer_class = ItemSerializer
-    lookup_field = 'id'
-    lookup_url_kwarg = 'item_id'
+class CatalogCacheStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(catalog_cache.get_stats())
+
+class EchoBuffer:
+    """File-like object whose `write` hands the line back, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+class CatalogExportView(APIView):
+    """
+    Streams the whole catalog with one row per stock variant, walking `Item`
+    through a server-side cursor so memory stays flat whatever the catalog size.
+    `?type=csv` produces the layout `import_catalog` reads; the default is NDJSON.
+    """
+    permission_classes = (IsAdminUser,)
+    chunk_size = 2000
+    item_fields = ('id', 'name', 'description', 'price', 'discount', 'price_with_discount', 'information',
+                   'brand', 'feature', 'size_table', 'total_stock')
+    csv_columns = item_fields + ('categories', 'color', 'hex', 'size', 'quantity')
 
     def get_queryset(self):
-        category_slug = self.kwargs['category_slug']
-        return Item.objects.filter(categories__slug=category_slug)
+        return Item.objects.order_by('pk').only(*self.item_fields).prefetch_related(
+            Prefetch('categories', queryset=Category.objects.only('name')),
+            Prefetch('stocks', queryset=ItemStock.objects.select_related('color', 'size').order_by('pk')),
+        ).iterator(chunk_size=self.chunk_size)
+
+    def get(self, request):
+        if request.query_params.get('type') == 'csv':
+            response = StreamingHttpResponse(self.stream_csv(), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="catalog.csv"'
+        else:
+            response = StreamingHttpResponse(self.stream_ndjson(), content_type='application/x-ndjson')
+        return response
+
+    def get_variants(self, item):
+        return [{
+            'color': stock.color.name if stock.color else None,
+            'hex': stock.color.hex if stock.color else None,
+            'size': stock.size.name if stock.size else None,
+            'quantity': stock.quantity,
+        } for stock in item.stocks.all()]
 
+    def stream_ndjson(self):
+        for item in self.get_queryset():
+            row = {field: getattr(item, field) for field in self.item_fields}
+            row['categories'] = [category.name for category in item.categories.all()]
+            row['stocks'] = self.get_variants(item)
+            yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+    def stream_csv(self):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(self.csv_columns)
+        for item in self.get_queryset():
+            values = [getattr(item, field) for field in self.item_fields]
+            values.append('|'.join(category.name for category in item.categories.all()))
+            for variant in self.get_variants(item) or [dict.fromkeys(('color', 'hex', 'size', 'quantity'))]:
+                yield writer.writerow(values + [variant['color'], variant['hex'], variant['size'], variant['quantity']])
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        context['request'] = self.request
-        return context
 
 class StockItemView(generics.ListAPIView):
     serializer_class = StockItemSerializer
 
     def get_queryset(self):
         item_id = self.kwargs['item_id']
-        queryset = ItemStock.objects.filter(item_id=item_id)
+        return self.filter_variants(ItemStock.objects.filter(item_id=item_id))
 
+    def filter_variants(self, queryset):
         colors = self.request.query_params.get('color')
         sizes = self.request.query_params.get('size')
 
+        # Names resolve through the process-local dimension caches, so the filters need no join.
         if colors:
-            colors = colors.split(',')
-            queryset = queryset.filter(color__name__in=colors)
+            queryset = queryset.filter(color_id__in=color_cache.get_ids(colors.split(',')))
 
         if sizes:
-            sizes = sizes.split(',')
-            queryset = queryset.filter(size__name__in=sizes)
+            queryset = queryset.filter(size_id__in=size_cache.get_ids(sizes.split(',')))
 
-        return queryset
+        return queryset.select_related('color', 'size')
 
+    @conditional_response(ITEMS)
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
         return Response({'stock_items': serializer.data})
+
+
+class StockItemsView(StockItemView):
+    """Stock of many items (`?items=1,2,3`) in one query, grouped by item id."""
+    max_items = 100
+
+    def get_item_ids(self):
+        try:
+            item_ids = [int(item_id) for item_id in self.request.query_params.get('items', '').split(',') if item_id]
+        except ValueError:
+            raise ValidationError({'items': 'Ожидается список id через запятую'})
+        if not item_ids:
+            raise ValidationError({'items': 'Параметр items обязателен'})
+        if len(item_ids) > self.max_items:
+            raise ValidationError({'items': f'Не больше {self.max_items} товаров за запрос'})
+        return list(dict.fromkeys(item_ids))
+
+    def get_queryset(self):
+        return self.filter_variants(ItemStock.objects.filter(item_id__in=self.item_ids)).order_by('item_id', 'pk')
+
+    @conditional_response(ITEMS)
+    def list(self, request, *args, **kwargs):
+        self.item_ids = self.get_item_ids()
+        grouped = {item_id: [] for item_id in self.item_ids}
+        for row in self.get_serializer(self.get_queryset(), many=True).data:
+            grouped[row['item_id']].append(row)
+        return Response({'stock_items': grouped})
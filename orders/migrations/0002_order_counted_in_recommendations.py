@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_alter_telnocode_expires'),
+        ('orders', '0001_initial'),
+        ('purchases', '0006_payment_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='counted_in_recommendations',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('counted_in_recommendations', False)), fields=['id'], name='order_uncounted_idx'),
+        ),
+    ]
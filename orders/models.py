@@ -20,6 +20,16 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='created')
     payment = models.OneToOneField(Payment, on_delete=models.CASCADE, null=True, blank=True)
+    # Set by build_recommendations once the order's items are counted into ItemCooccurrence.
+    counted_in_recommendations = models.BooleanField(default=False, editable=False)
+
+    PAID_STATUSES = ('paid', 'delivered', 'received')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(counted_in_recommendations=False),
+                         name='order_uncounted_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.user}"
@@ -1,18 +1,29 @@
 from django.contrib import admin
 from rest_framework.exceptions import ValidationError
 
+from api.admin import FastChangeListAdmin
 from .models import Basket, BasketItem, FavouritesItem, Favourites
 
 
 class BasketItemInline(admin.TabularInline):
     model = BasketItem
     extra = 1
+    autocomplete_fields = ('product',)
 
 @admin.register(Basket)
-class BasketAdmin(admin.ModelAdmin):
+class BasketAdmin(FastChangeListAdmin):
     inlines = [BasketItemInline]
+    list_select_related = ('user',)
+    list_only = ('user__telNo',)
+    search_fields = ('user__telNo',)
+
+class BasketItemAdmin(FastChangeListAdmin):
+    list_display = ('__str__', 'quantity')
+    # __str__ renders the item name and the basket owner.
+    list_select_related = ('product__item', 'basket__user')
+    list_only = ('quantity', 'product__item__name', 'basket__user__telNo')
+    autocomplete_fields = ('basket', 'product')
 
-class BasketItemAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         try:
             obj.save()
@@ -20,4 +31,3 @@ class BasketItemAdmin(admin.ModelAdmin):
             self.message_user(request, str(e), level='warning')
 
 admin.site.register(BasketItem, BasketItemAdmin)
-
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_basket_items(apps, schema_editor):
+    BasketItem = apps.get_model('purchases', 'BasketItem')
+    duplicates = BasketItem.objects.values('basket_id', 'product_id').annotate(
+        keep=Min('pk'), total=Sum('quantity'), rows=Count('pk'),
+    ).filter(rows__gt=1)
+    for line in duplicates:
+        BasketItem.objects.filter(basket_id=line['basket_id'], product_id=line['product_id']).exclude(
+            pk=line['keep']).delete()
+        BasketItem.objects.filter(pk=line['keep']).update(quantity=line['total'])
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_itemstock_variant_unique'),
+        ('purchases', '0006_payment_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_basket_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basketitem',
+            constraint=models.UniqueConstraint(fields=('basket', 'product'), name='basket_item_product_unique'),
+        ),
+    ]
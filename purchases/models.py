@@ -1,7 +1,7 @@
 import uuid
 
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models
 from django.utils.translation import gettext_lazy
 from rest_framework.exceptions import ValidationError
 
@@ -35,9 +35,37 @@ class BasketItem(models.Model):
     product = models.ForeignKey(ItemStock, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)], default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['basket', 'product'], name='basket_item_product_unique'),
+        ]
+
     def __str__(self):
         return f"{self.product.item.name} in {self.basket}"
 
+    @classmethod
+    def add(cls, basket_id, item_id, color_ids, size_ids, quantity):
+        """
+        Resolve the (item, color, size) variant and add `quantity` of it to
+        the basket in a single statement. A color or size name can belong to
+        several rows, so every id of it is matched. Returns the basket item
+        id, or `None` when no such variant exists.
+        """
+        quote_name = connection.ops.quote_name
+        table = quote_name(cls._meta.db_table)
+        sql = f"""
+            INSERT INTO {table} (basket_id, product_id, quantity)
+            SELECT %s, stock.id, %s FROM {quote_name(ItemStock._meta.db_table)} stock
+            WHERE stock.item_id = %s AND stock.color_id = ANY(%s) AND stock.size_id = ANY(%s)
+            ORDER BY stock.id LIMIT 1
+            ON CONFLICT (basket_id, product_id) DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity
+            RETURNING id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [basket_id, quantity, item_id, list(color_ids), list(size_ids)])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
     @property
     def total_price(self):
         return self.product.item.price_with_discount * self.quantity
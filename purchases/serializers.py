@@ -50,7 +50,7 @@ class AddToBasketSerializer(serializers.Serializer):
     item_id = serializers.IntegerField()
     color = serializers.CharField()
     size = serializers.CharField()
-    quantity = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
 
     class Meta:
         fields = ['item_id', 'color', 'size', 'quantity']
@@ -1,6 +1,7 @@
 import json
 import logging
 
+from django.db import transaction
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, status, generics
@@ -12,7 +13,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from api.models import Item, ItemStock, Color, Size
+from api.models import Item, ItemStock, color_cache, size_cache
 from authentication.backends import CookieJWTAuthentication
 from orders.models import Order, OrderItem
 
@@ -130,53 +131,33 @@ class AddToBasketView(generics.CreateAPIView):
 
             logger.info(f"Полученные данные: item_id={item_id}, color={color}, size={size}, quantity={quantity}")
 
-            try:
-                logger.info(f"Пытаемся найти объект Color с именем '{color}'")
-                color_obj = Color.objects.get(name=color)
-                color_id = color_obj.id
-                logger.info(f"Найден Color: {color_obj} (id={color_id})")
-            except Color.DoesNotExist:
+            # Цвет и размер берутся из кэша справочников процесса, без запросов к базе
+            color_ids = color_cache.get_ids([color])
+            if not color_ids:
                 logger.warning(f"Цвет '{color}' не найден в базе.")
                 return Response({"error": True, "message": "Invalid color"}, status=status.HTTP_400_BAD_REQUEST)
-            
-            try:
-                logger.info(f"Пытаемся найти объект Size с именем '{size}'")
-                size_obj = Size.objects.get(name=size)
-                size_id = size_obj.id
-                logger.info(f"Найден Size: {size_obj} (id={size_id})")
-            except Size.DoesNotExist:
+            logger.info(f"Найден Color '{color}' (id={color_ids})")
+
+            size_ids = size_cache.get_ids([size])
+            if not size_ids:
                 logger.warning(f"Размер '{size}' не найден в базе.")
                 return Response({"error": True, "message": "Invalid size"}, status=status.HTTP_400_BAD_REQUEST)
+            logger.info(f"Найден Size '{size}' (id={size_ids})")
 
-            try:
-                # Логирование всех записей для товара item_id
-                existing_stock = ItemStock.objects.all().values("id", "item", "color", "size")
-                logger.info(f"Все записи ItemStock: {list(existing_stock)}")
-                
-                logger.info(f"Пытаемся найти товар с item_id={item_id}, color_id={color_id}, size_id={size_id}")
-                product = ItemStock.objects.get(item=item_id, color=color_id, size=size_id)
-                logger.info(f"Товар найден: {product}")
-            except ItemStock.DoesNotExist:
-                logger.error(f"Товар item_id={item_id}, color={color}, size={size} не найден.")
-                return Response({"error": True, "message": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
-
-            logger.info("Пытаемся получить или создать корзину для пользователя.")
             basket, basket_created = Basket.objects.get_or_create(user=user)
             if basket_created:
                 logger.info(f"Создана новая корзина для пользователя {user}.")
-            else:
-                logger.info(f"Найдена существующая корзина для пользователя {user}.")
 
-            logger.info("Пытаемся получить или создать элемент корзины для найденного товара.")
-            basket_item, item_created = BasketItem.objects.get_or_create(basket=basket, product=product)
-            if not item_created:
-                basket_item.quantity += quantity
-                logger.info(f"Количество товара обновлено: {basket_item.quantity} шт.")
-            else:
-                basket_item.quantity = quantity
-                logger.info(f"Товар добавлен в корзину: {basket_item.quantity} шт.")
+            # Поиск варианта товара и добавление в корзину — один запрос по уникальному индексу
+            basket_item_id = BasketItem.add(basket.id, item_id, color_ids, size_ids, quantity)
+            if basket_item_id is None:
+                logger.error(f"Товар item_id={item_id}, color={color}, size={size} не найден.")
+                return Response({"error": True, "message": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
 
-            basket_item.save()
+            basket_item = BasketItem.objects.select_related(
+                'product__item__general_photo_one__photo', 'product__color', 'product__size',
+            ).prefetch_related('product__item__categories').get(pk=basket_item_id)
+            logger.info(f"Количество товара в корзине: {basket_item.quantity} шт.")
 
             basket_item_serializer = BasketItemSerializer(basket_item)
             logger.info(f"Товар успешно добавлен/обновлён в корзине. Ответ: {basket_item_serializer.data}")
@@ -258,19 +239,22 @@ def webhook_view(request):
                 if payment.status == Payment.PaymentStatus.SUCCEEDED:
                     logger.info(f"Платёж {payment_id} подтверждён. Обновляем заказ и уменьшаем количество на складе.")
 
-                    basket_items = BasketItem.objects.filter(basket=payment.basket)
-                    order = Order.objects.get(user=payment.user, payment=payment)
-                    order.status = "paid"
-                    order.save()
-
-                    for item in basket_items:
-                        stock_item = ItemStock.objects.get(item=item.product.item, color=item.product.color, size=item.product.size)
-                        stock_item.quantity -= item.quantity
-                        stock_item.save()
-                        item.product.item.order_count += item.quantity
-                        item.product.item.save()
-
-                    basket_items.delete()
+                    # Stock decrements and the items' stock totals are committed together.
+                    with transaction.atomic():
+                        basket_items = BasketItem.objects.filter(basket=payment.basket)
+                        order = Order.objects.get(user=payment.user, payment=payment)
+                        order.status = "paid"
+                        order.save()
+
+                        for item in basket_items:
+                            stock_item = ItemStock.objects.select_for_update().get(
+                                item=item.product.item, color=item.product.color, size=item.product.size)
+                            stock_item.quantity -= item.quantity
+                            stock_item.save()
+                            item.product.item.order_count += item.quantity
+                            item.product.item.save()
+
+                        basket_items.delete()
                     logger.info(f"Заказ {order.id} успешно завершён и оплачен.")
 
                 payment.save()
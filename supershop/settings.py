@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'api',
@@ -123,6 +124,27 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'supershop',
+    }
+}
+
+# Catalog responses are cached per process under version counters kept in the database
+# (api.CatalogCounter) and bumped by model signals; the timeout only bounds memory use.
+CATALOG_CACHE_TIMEOUT = 60 * 60
+CATALOG_STATS_FLUSH_SIZE = 100
+CATALOG_STATS_FLUSH_INTERVAL = 60
+
+# Time-decayed popularity (see api.popularity): a sale or view loses half its weight every half-life.
+# Web processes buffer views and write them out every FLUSH_SIZE views or FLUSH_INTERVAL seconds.
+POPULARITY_HALF_LIFE_DAYS = 14
+POPULARITY_WINDOW_DAYS = 90
+POPULARITY_VIEW_WEIGHT = 0.05
+POPULARITY_VIEW_FLUSH_SIZE = 100
+POPULARITY_VIEW_FLUSH_INTERVAL = 60
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -167,6 +189,12 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Resized variants of uploaded photos, built off-request by api.images
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1280)
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'avif')
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
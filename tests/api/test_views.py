@@ -1,10 +1,34 @@
+import itertools
+import json
+from io import BytesIO, StringIO
+
 import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APIClient
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
-from api.models import Item, Category, Photo, ItemStock, Color, Size
+from PIL import Image
+from api import cache as catalog_cache, images, popularity
+from api.pagination import KeysetPagination
+from api.models import Item, Category, Photo, ItemStock, Color, Size, Item_Photos, color_cache
 from api.serializers import ItemSerializer, CategorySerializer, PhotoSerializer, StockItemSerializer
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    catalog_cache._pending_stats.clear()
+    yield
+    # Таймер сброса просмотров не переживает тест
+    popularity._take_pending()
+
 @pytest.fixture
 def api_client():
     return APIClient()
@@ -60,6 +84,142 @@ def test_get_max_price(api_client, item):
     assert response.status_code == status.HTTP_200_OK
     assert response.data["max_price"] == 90  # 100 - 10 (discount)
 
+POPULATE_OPTIONS = ("all_photo", "general_photos", "categories", "colors_sizes")
+
+
+def create_populated_item(index, category, color, size):
+    item = Item.objects.create(name=f"Item {index}", price=100)
+    item.categories.add(category)
+    for photo_index in range(2):
+        photo = Photo.objects.create(name=f"photo-{index}-{photo_index}", photo="test.jpg")
+        Item_Photos.objects.create(item=item, photo=photo)
+    item.general_photo_one = item.item_photos.first()
+    item.save()
+    ItemStock.objects.create(item=item, color=color, size=size, quantity=3)
+    return item
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("populate", [
+    ",".join(combination)
+    for length in range(len(POPULATE_OPTIONS) + 1)
+    for combination in itertools.combinations(POPULATE_OPTIONS, length)
+])
+def test_get_items_query_count_is_constant(api_client, category, color, size, populate):
+    url = reverse("item-list") + f"?cursor=&populate={populate}"
+    create_populated_item(0, category, color, size)
+
+    with CaptureQueriesContext(connection) as single_item_page:
+        api_client.get(url)
+
+    for index in range(1, 5):
+        create_populated_item(index, category, color, size)
+
+    with CaptureQueriesContext(connection) as full_page:
+        response = api_client.get(url)
+
+    assert len(response.data["results"]) == 5
+    assert len(full_page) == len(single_item_page)
+
+@pytest.mark.django_db
+def test_keyset_pagination_applies_id_tiebreaker():
+    ids = [Item.objects.create(name=f"Item {index}", price=100).id for index in range(5)]
+    paginator = KeysetPagination()
+    paginator.page_size = 2
+
+    # Сортировка только по цене: id дописывается и в курсор, и в ORDER BY
+    seen = []
+    url = "/api/items/?cursor="
+    while url:
+        request = Request(APIRequestFactory().get(url))
+        with CaptureQueriesContext(connection) as queries:
+            seen += [item.id for item in paginator.paginate_queryset(Item.objects.order_by("price"), request)]
+        assert 'ORDER BY "api_item"."price" ASC, "api_item"."id" ASC' in queries[-1]["sql"]
+        url = paginator.get_next_link()
+    assert seen == ids
+
+@pytest.mark.django_db
+def test_item_stock_totals_follow_stock_changes(api_client, item, stock):
+    item.name = "Renamed"
+    item.save()  # the instance still holds the totals from before the stock was added
+    item.refresh_from_db()
+    assert (item.total_stock, item.is_in_stock) == (10, True)
+
+    stock.quantity = 0
+    stock.save()
+    item.refresh_from_db()
+    assert (item.total_stock, item.is_in_stock) == (0, False)
+
+    response = api_client.get(reverse("item-list") + "?in_stock=1")
+    assert response.data == []
+
+@pytest.mark.django_db(transaction=True)
+def test_get_category_price_bounds_from_stats(api_client, item, category, django_assert_num_queries):
+    item.categories.add(category)
+    cheap = Item.objects.create(name="Cheap Item", price=10)
+    cheap.categories.add(category)
+
+    with django_assert_num_queries(2):
+        response = api_client.get(reverse("category-items-max-price", kwargs={"category_slug": "test-category"}))
+    assert response.data["max_price"] == 90
+
+    response = api_client.get(reverse("category-items-min-price", kwargs={"category_slug": "test-category"}))
+    assert response.data["min_price"] == 10
+
+    cheap.delete()
+    response = api_client.get(reverse("category-items-min-price", kwargs={"category_slug": "test-category"}))
+    assert response.data["min_price"] == 90
+
+@pytest.mark.django_db
+def test_category_stats_follow_item_changes(item, category, stock):
+    item.categories.add(category)
+    stats = category.stats
+    stats.refresh_from_db()
+    assert (stats.item_count, stats.in_stock_count, stats.discounted_count) == (1, 1, 1)
+
+    item.discount = 0
+    item.save()
+    stock.quantity = 0
+    stock.save()
+    stats.refresh_from_db()
+    assert (stats.max_price, stats.in_stock_count, stats.discounted_count) == (100, 0, 0)
+
+    item.categories.clear()
+    stats.refresh_from_db()
+    assert (stats.item_count, stats.max_price) == (0, None)
+
+@pytest.mark.django_db
+def test_category_stats_apply_deltas(item, category, stock):
+    cheap = Item.objects.create(name="Cheap Item", price=10)
+    item.categories.add(category)
+    cheap.categories.add(category)
+    stats = category.stats
+    other = Category.objects.create(name="Other Category")
+
+    # Заказы и списание остатка, не меняющее наличие, статистику не трогают
+    with CaptureQueriesContext(connection) as queries:
+        item.order_count += 1
+        item.save()
+        stock.quantity -= 1
+        stock.save()
+        item.categories.remove(other)
+    assert not [query for query in queries if "api_categorystats" in query["sql"]]
+
+    # Границы пересчитываются, только когда уходит цена на границе
+    cheap.price = 50
+    cheap.save()
+    stats.refresh_from_db()
+    assert (stats.min_price, stats.max_price, stats.item_count) == (50, 90, 2)
+
+    item.price = 20
+    item.save()
+    stats.refresh_from_db()
+    assert (stats.min_price, stats.max_price, stats.discounted_count) == (18, 50, 1)
+
+    cheap.delete()
+    stats.refresh_from_db()
+    assert (stats.min_price, stats.max_price, stats.item_count, stats.in_stock_count) == (18, 18, 1, 1)
+
 # ===============================
 # 🔹 ТЕСТЫ ДЛЯ CategoryViewSet
 # ===============================
@@ -72,6 +232,37 @@ def test_get_categories(api_client, category):
     assert response.data["count"] == 1
     assert response.data["results"][0]["slug"] == "test-category"
 
+@pytest.mark.django_db
+def test_get_categories_query_count_is_constant(api_client, item, django_assert_num_queries):
+    for index in range(5):
+        item.categories.add(Category.objects.create(name=f"Category {index}"))
+
+    with django_assert_num_queries(3):
+        response = api_client.get(reverse("category-list"))
+
+    # The item fixture also creates "Test Category", which stays empty.
+    assert response.data["count"] == 6
+    assert sum(category["item_count"] for category in response.data["results"]) == 5
+
+@pytest.mark.django_db(transaction=True)
+def test_get_category_tree(api_client, item, category, django_assert_num_queries):
+    item.categories.add(category)
+    url = reverse("category-tree")
+
+    response = api_client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data[0]["slug"] == "test-category"
+    assert response.data[0]["item_count"] == 1
+    assert response.data[0]["items_url"] == "http://testserver/api/categories/test-category/items/"
+
+    item.price = 500
+    item.save()
+    with django_assert_num_queries(1):
+        api_client.get(url)
+
+    item.categories.remove(category)
+    assert api_client.get(url).data[0]["item_count"] == 0
+
 # ===============================
 # 🔹 ТЕСТЫ ДЛЯ PhotoViewSet
 # ===============================
@@ -84,17 +275,24 @@ def test_get_photos(api_client, photo):
     assert response.data["count"] == 1
 
 # ===============================
-# 🔹 ТЕСТЫ ДЛЯ ItemDetail
+# 🔹 ТЕСТЫ ДЛЯ карточки товара
 # ===============================
 @pytest.mark.django_db
-def test_get_item_detail(api_client, item, category):
+def test_get_item_detail(api_client, item, category, django_assert_num_queries):
     item.categories.add(category)
-    url = reverse("item-detail", kwargs={"category_slug": "test-category", "item_id": item.id})
+    url = reverse("category-items-detail", kwargs={"category_slug": "test-category", "pk": item.id})
     response = api_client.get(url)
 
     assert response.status_code == status.HTTP_200_OK
     assert response.data["name"] == "Test Item"
 
+    # Повторный запрос и условный запрос обслуживаются кэшем
+    with django_assert_num_queries(1):
+        assert api_client.get(url).data["name"] == "Test Item"
+    with django_assert_num_queries(1):
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
 # ===============================
 # 🔹 ТЕСТЫ ДЛЯ StockItemView
 # ===============================
@@ -106,3 +304,681 @@ def test_get_stock_items(api_client, stock):
     assert response.status_code == status.HTTP_200_OK
     assert len(response.data["stock_items"]) == 1
     assert response.data["stock_items"][0]["quantity"] == 10
+
+@pytest.mark.django_db
+def test_get_stock_items_batch(api_client, stock, color, size, django_assert_num_queries):
+    other = Item.objects.create(name="Other", price=50)
+    ItemStock.objects.create(item=other, color=color, size=size, quantity=4)
+    ItemStock.objects.create(item=other, color=Color.objects.create(name="Blue"), size=size, quantity=2)
+    url = reverse("stock-items") + f"?items={stock.item.id},{other.id},999999&color=Red"
+    color_cache.get_ids(["Red"])
+
+    with django_assert_num_queries(2):
+        response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    stock_items = response.data["stock_items"]
+    assert [row["quantity"] for row in stock_items[stock.item.id]] == [10]
+    assert [row["quantity"] for row in stock_items[other.id]] == [4]
+    assert stock_items[999999] == []
+    assert api_client.get(reverse("stock-items") + "?items=a").status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db
+def test_get_items_cursor_pagination(api_client):
+    for order_count in (3, 2, 1):
+        Item.objects.create(name=f"Item {order_count}", price=100, order_count=order_count)
+
+    url = reverse("item-list") + "?cursor=&limit=2&sort=bestsellers"
+    response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert "count" not in response.data
+    assert response.data["previous"] is None
+    assert [i["order_count"] for i in response.data["results"]] == [3, 2]
+
+    response = api_client.get(response.data["next"])
+    assert [i["order_count"] for i in response.data["results"]] == [1]
+    assert response.data["next"] is None
+
+    response = api_client.get(response.data["previous"])
+    assert [i["order_count"] for i in response.data["results"]] == [3, 2]
+    assert response.data["previous"] is None
+
+@pytest.mark.django_db
+def test_get_items_cursor_pagination_with_count(api_client, item):
+    url = reverse("item-list") + "?cursor=&with_count=1&sort=price_asc"
+    response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["count"] == 1
+
+@pytest.mark.django_db
+def test_get_items_invalid_cursor(api_client, item):
+    url = reverse("item-list") + "?cursor=garbage"
+    response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ ItemCard
+# ===============================
+@pytest.mark.django_db
+def test_get_item_cards(api_client, item, category, stock):
+    item.categories.add(category)
+    url = reverse("category-items-cards", kwargs={"category_slug": "test-category"}) + "?in_stock=1"
+    response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data) == 1
+    card = response.data[0]
+    assert card["id"] == item.id
+    assert card["category_slugs"] == ["test-category"]
+    assert card["colors"] == [{"name": "Red", "hex": "#FF0000"}]
+    assert card["sizes"] == [{"name": "M"}]
+    assert card["total_stock"] == 10
+
+@pytest.mark.django_db
+def test_item_cards_follow_stock_changes(api_client, stock, django_assert_num_queries):
+    stock.delete()
+    url = reverse("item-cards") + "?cursor=&in_stock=1"
+
+    with django_assert_num_queries(2):
+        response = api_client.get(url)
+
+    assert response.data["results"] == []
+
+@pytest.mark.django_db(transaction=True)
+def test_item_cards_follow_color_and_size_changes(api_client, item, stock, color, size):
+    url = reverse("item-cards")
+    color.name = "Crimson"
+    color.hex = "#DC143C"
+    color.save()
+    assert api_client.get(url).data[0]["colors"] == [{"name": "Crimson", "hex": "#DC143C"}]
+
+    # Удаление размера удаляет и остатки, карточка обновляется один раз
+    size.delete()
+    card = api_client.get(url).data[0]
+    assert (card["sizes"], card["colors"], card["total_stock"]) == ([], [], 0)
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ кэша каталога
+# ===============================
+@pytest.mark.django_db
+def test_catalog_cache_serves_repeated_requests(api_client, item, django_assert_num_queries):
+    api_client.get(reverse("item-list") + "?populate=categories,all_photo&limit=5")
+
+    # Из базы читаются только общие счётчики версий
+    with django_assert_num_queries(1):
+        response = api_client.get(reverse("item-list") + "?limit=5&populate=all_photo,categories")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data) == 1
+
+@pytest.mark.django_db(transaction=True)
+def test_catalog_cache_is_invalidated_by_signals(api_client, item):
+    url = reverse("item-max-price")
+    assert api_client.get(url).data["max_price"] == 90
+
+    item.price = 200
+    item.save()
+
+    assert api_client.get(url).data["max_price"] == 180
+
+@pytest.mark.django_db
+def test_catalog_cache_stats(api_client, item):
+    admin = get_user_model().objects.create_superuser(email="admin@example.com", password="password")
+    api_client.get(reverse("item-max-price"))
+    api_client.get(reverse("item-max-price"))
+
+    api_client.force_authenticate(user=admin)
+    response = api_client.get(reverse("catalog-cache-stats"))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["hits"] == 1
+    assert response.data["misses"] == 1
+
+@pytest.mark.django_db(transaction=True)
+def test_catalog_cache_is_invalidated_by_management_commands(api_client):
+    from api.models import CatalogCounter, ItemDailyViews
+    from django.utils import timezone
+
+    older, newer = Item.objects.create(name="Older", price=100), Item.objects.create(name="Newer", price=100)
+    url = reverse("item-list")
+    response = api_client.get(url)
+    assert [item["id"] for item in response.data] == [newer.id, older.id]
+    version = CatalogCounter.objects.get(name=catalog_cache.VERSION_KEY.format(catalog_cache.ITEMS)).value
+
+    # Просмотры пишутся без сигналов; версию поднимает команда, как это сделал бы другой процесс
+    ItemDailyViews.objects.create(item=older, day=timezone.localdate(), views=100)
+    call_command("update_popularity", stdout=StringIO())
+
+    assert CatalogCounter.objects.get(name=catalog_cache.VERSION_KEY.format(catalog_cache.ITEMS)).value == version + 1
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["id"] for item in response.data] == [older.id, newer.id]
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ поиска
+# ===============================
+@pytest.mark.django_db
+@pytest.mark.parametrize("query", ["Кроссовки", "krossovki", "krosovki", "Nike"])
+def test_search_items(api_client, query):
+    Item.objects.create(name="Кроссовки беговые", brand="Nike", price=100)
+    Item.objects.create(name="Футболка", price=100)
+
+    url = reverse("item-search") + f"?q={query}"
+    response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["name"] for item in response.data] == ["Кроссовки беговые"]
+
+@pytest.mark.django_db
+def test_search_items_respects_filters(api_client):
+    Item.objects.create(name="Кроссовки беговые", price=100)
+    Item.objects.create(name="Кроссовки зимние", price=300)
+
+    url = reverse("item-search") + "?q=кросс&max_price=200"
+    response = api_client.get(url)
+
+    assert [item["name"] for item in response.data] == ["Кроссовки беговые"]
+
+@pytest.mark.django_db
+def test_search_items_keyset_pages_by_rank(api_client):
+    names = ["Кроссовки беговые", "Кроссовки зимние", "Кроссовки", "Кеды кросс"]
+    expected = [Item.objects.create(name=name, price=100).id for name in names for _ in range(2)]
+
+    # Страницы по одной позиции: ни повторов, ни пропусков при равных рангах
+    seen = []
+    url = reverse("item-search") + "?q=kross&limit=1&cursor="
+    while url and len(seen) <= len(expected):
+        response = api_client.get(url)
+        seen += [item["id"] for item in response.data["results"]]
+        url = response.data["next"]
+    assert sorted(seen) == sorted(expected)
+    assert len(seen) == len(set(seen))
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ фасетов
+# ===============================
+@pytest.mark.django_db
+def test_get_item_facets(api_client, item, category, stock, django_assert_num_queries):
+    item.categories.add(category)
+    Item.objects.create(name="Expensive Item", price=5000)
+
+    with django_assert_num_queries(3):
+        response = api_client.get(reverse("item-facets"))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["total"] == 2
+    assert response.data["discount"] == {"with_discount": 1, "without_discount": 1}
+    assert [bucket["count"] for bucket in response.data["price"]] == [1, 0, 0, 1, 0]
+    assert response.data["colors"] == [{"name": "Red", "hex": "#FF0000", "count": 1}]
+    assert response.data["sizes"] == [{"name": "M", "count": 1}]
+    assert response.data["categories"] == [{"slug": "test-category", "name": "Test Category", "count": 1}]
+
+@pytest.mark.django_db
+def test_get_item_facets_uses_list_filters(api_client, item, stock):
+    response = api_client.get(reverse("item-facets") + "?min_price=1000&in_stock=1")
+
+    assert response.data["total"] == 0
+    assert response.data["colors"] == []
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ условных запросов
+# ===============================
+@pytest.mark.django_db(transaction=True)
+def test_conditional_get_returns_not_modified(api_client, item, django_assert_num_queries):
+    url = reverse("item-list")
+    response = api_client.get(url)
+    etag = response["ETag"]
+    assert response["Last-Modified"]
+
+    with django_assert_num_queries(1):
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    item.price = 500
+    item.save()
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response["ETag"] != etag
+
+@pytest.mark.django_db
+def test_conditional_get_stock_items(api_client, stock, django_assert_num_queries):
+    url = reverse("stock-item-detail", kwargs={"item_id": stock.item.id})
+    response = api_client.get(url)
+
+    with django_assert_num_queries(1):
+        response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+@pytest.mark.django_db(transaction=True)
+def test_conditional_get_sees_changes_within_a_second(api_client, item):
+    url = reverse("item-list")
+    last_modified = api_client.get(url)["Last-Modified"]
+
+    # Изменение в ту же секунду всё равно сдвигает Last-Modified
+    item.price = 500
+    item.save()
+    response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Last-Modified"] != last_modified
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ fields / omit
+# ===============================
+@pytest.mark.django_db
+def test_get_items_sparse_fields(api_client, category, color, size):
+    for index in range(3):
+        create_populated_item(index, category, color, size)
+    url = reverse("item-list") + "?cursor=&fields=name,price,all_photos&populate=colors_sizes"
+
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert set(response.data["results"][0]) == {"id", "name", "price", "all_photos"}
+    # Не запрошенные столбцы не выбираются, а stocks не подгружаются
+    assert len(queries) == 3
+    assert '"api_item"."description"' not in queries[0]["sql"]
+
+@pytest.mark.django_db
+def test_item_colors_and_sizes_keep_stock_order(api_client, item):
+    names = ["White", "Red", "Black", "Olive", "Blue", "Yellow"]
+    sizes = [Size.objects.create(name=name) for name in ("XL", "S", "M")]
+    for index, name in enumerate(names):
+        color = Color.objects.create(name=name, hex=f"#00000{index}")
+        for size in sizes:
+            ItemStock.objects.create(item=item, color=color, size=size, quantity=1)
+
+    # Порядок не зависит от хэширования строк в процессе
+    response = api_client.get(reverse("item-list") + "?cursor=&populate=colors_sizes&fields=colors,sizes")
+    result = response.data["results"][0]
+    assert [color["name"] for color in result["colors"]] == names
+    assert [size["name"] for size in result["sizes"]] == ["XL", "S", "M"]
+
+@pytest.mark.django_db
+def test_get_item_detail_omit(api_client, item, category):
+    item.categories.add(category)
+    url = reverse("category-items-detail", kwargs={"category_slug": category.slug, "pk": item.id})
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.get(url + "?omit=description,information,colors")
+
+    assert response.status_code == status.HTTP_200_OK
+    item_query = next(query["sql"] for query in queries if query["sql"].startswith('SELECT "api_item"'))
+    assert '"api_item"."description"' not in item_query
+    assert "description" not in response.data
+    assert "colors" not in response.data
+    assert response.data["name"] == item.name
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ производных изображений
+# ===============================
+@pytest.mark.django_db
+def test_photo_derivatives_are_built_and_cleaned_up(settings, api_client):
+    settings.IMAGE_DERIVATIVE_WORKERS = 0
+    buffer = BytesIO()
+    Image.new("RGB", (1000, 500), "red").save(buffer, format="JPEG")
+    photo = Photo.objects.create(name="derivative", photo=ContentFile(buffer.getvalue(), name="big.jpg"))
+
+    # Пока производные не записаны в строку, srcset их не обещает
+    assert PhotoSerializer(photo).data["srcset"] is None
+
+    derivatives = images.generate_derivatives(photo.photo.name)
+    assert derivatives == {fmt: [320, 640, 1280] for fmt in images.get_formats()}
+    derivative = images.get_derivative_name(photo.photo.name, 320, "webp")
+    assert Image.open(default_storage.open(derivative)).size == (320, 160)
+    # Одноимённые загрузки с разными расширениями не делят производные
+    assert images.get_derivative_name("item/foo.jpg", 320, "webp") != images.get_derivative_name("item/foo.png", 320, "webp")
+
+    images.record_derivatives(photo.photo.name, {"webp": [320, 640]})
+    photo.refresh_from_db()
+    srcset = PhotoSerializer(photo).data["srcset"]
+    assert srcset == {"webp": ", ".join(
+        f"{default_storage.url(images.get_derivative_name(photo.photo.name, width, 'webp'))} {width}w"
+        for width in (320, 640))}
+
+    kept = Photo.objects.create(name="kept", photo=ContentFile(buffer.getvalue(), name="kept.jpg"))
+    images.generate_derivatives(kept.photo.name)
+    name = photo.photo.name
+    photo.delete()
+
+    # Без воркеров файлы удалённой фотографии собирает gc_media
+    out = StringIO()
+    call_command("gc_media", "--dry-run", "--min-age=0", stdout=out)
+    assert f"{3 * len(images.get_formats()) + 1} orphaned files" in out.getvalue()
+    assert default_storage.exists(derivative)
+
+    call_command("gc_media", "--min-age=0", stdout=StringIO())
+    assert not default_storage.exists(name)
+    assert not default_storage.exists(derivative)
+    assert default_storage.exists(kept.photo.name)
+    assert default_storage.exists(images.get_derivative_name(kept.photo.name, 320, "webp"))
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ import_catalog
+# ===============================
+@pytest.mark.django_db
+def test_import_catalog_upserts_items_and_stocks(tmp_path, api_client):
+    path = tmp_path / "catalog.csv"
+    path.write_text(
+        "id,name,price,discount,brand,categories,color,hex,size,quantity\n"
+        "501,Куртка,1000,0.2,Acme,Outerwear|Sale,Red,#FF0000,M,3\n"
+        "501,Куртка,1000,0.2,Acme,Outerwear|Sale,Red,#FF0000,L,0\n"
+        "502,Шапка,200,0,,Outerwear,,,,\n",
+        encoding="utf-8",
+    )
+    call_command("import_catalog", str(path), batch_size=2, stdout=StringIO())
+
+    item = Item.objects.get(pk=501)
+    assert item.price_with_discount == 800
+    assert item.search_name == "kurtka"
+    assert (item.total_stock, item.is_in_stock) == (3, True)
+    assert set(item.categories.values_list("name", flat=True)) == {"Outerwear", "Sale"}
+    assert Category.objects.get(name="Outerwear").stats.item_count == 2
+    assert item.card.total_stock == 3
+
+    path.write_text("id,name,price,discount,categories,color,hex,size,quantity\n"
+                    "501,Куртка,1500,0,Outerwear,Red,#FF0000,M,7\n", encoding="utf-8")
+    call_command("import_catalog", str(path), stdout=StringIO())
+
+    item.refresh_from_db()
+    assert (item.price_with_discount, item.total_stock) == (1500, 7)
+    assert ItemStock.objects.filter(item=item).count() == 2
+    assert Item.objects.create(name="New").pk > 502
+
+@pytest.mark.django_db
+def test_import_catalog_jsonl_rows(tmp_path):
+    path = tmp_path / "catalog.jsonl"
+    # Без categories и stocks строка импортируется как товар без вариантов
+    path.write_text('{"id": 701, "name": "Шарф", "price": 300}\n', encoding="utf-8")
+    call_command("import_catalog", str(path), stdout=StringIO())
+    assert Item.objects.get(pk=701).total_stock == 0
+
+    path.write_text('{"id": 702, "name": "Шарф"}\n{"id": 703, "name": "Шапка", "stocks": {"quantity": 1}}\n',
+                    encoding="utf-8")
+    with pytest.raises(CommandError, match="Line 2: stocks must be a list"):
+        call_command("import_catalog", str(path), stdout=StringIO())
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ выгрузки каталога
+# ===============================
+@pytest.mark.django_db
+def test_catalog_export_streams_variants(api_client, item, stock, category, tmp_path):
+    item.categories.add(category)
+    url = reverse("catalog-export")
+    assert api_client.get(url).status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+
+    admin = get_user_model().objects.create_superuser(email="admin@example.com", password="password")
+    api_client.force_authenticate(user=admin)
+
+    response = api_client.get(url)
+    rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+    assert rows[0]["id"] == item.id
+    assert rows[0]["categories"] == [category.name]
+    assert rows[0]["stocks"][0]["quantity"] == stock.quantity
+
+    response = api_client.get(url + "?type=csv")
+    path = tmp_path / "catalog.csv"
+    path.write_bytes(b"".join(response.streaming_content))
+    item_id = item.id
+    item.delete()
+    # Выгрузка в CSV читается import_catalog
+    call_command("import_catalog", str(path), stdout=StringIO())
+    assert Item.objects.get(pk=item_id).total_stock == stock.quantity
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ главных фото товара
+# ===============================
+def count_updates(queries, table):
+    return sum(1 for query in queries if query["sql"].startswith(f'UPDATE "{table}"'))
+
+@pytest.mark.django_db
+def test_item_save_syncs_general_photo_flags(item):
+    photos = [Item_Photos.objects.create(item=item, photo=Photo.objects.create(name=f"general-{index}", photo="test.jpg"))
+              for index in range(3)]
+    item.general_photo_one = photos[0]
+    item.save()
+
+    item = Item.objects.get(pk=item.pk)
+    item.general_photo_one = photos[1]
+    item.general_photo_two = photos[2]
+    # Сохранение из админки: было 33 запроса (8 UPDATE фото), стало 9
+    with CaptureQueriesContext(connection) as queries:
+        item.save()
+
+    assert len(queries) <= 10
+    assert count_updates(queries, "api_item_photos") == 1
+    assert list(Item_Photos.objects.filter(item=item).order_by("pk").values_list("is_general_one", "is_general_two")) == [
+        (False, False), (True, False), (False, True)]
+
+@pytest.mark.django_db
+def test_item_save_clears_general_photo_with_two_updates(item):
+    photos = [Item_Photos.objects.create(item=item, photo=Photo.objects.create(name=f"general-{index}", photo="test.jpg"))
+              for index in range(2)]
+    item.general_photo_one, item.general_photo_two = photos
+    item.save()
+
+    item = Item.objects.get(pk=item.pk)
+    item.general_photo_one, item.general_photo_two = photos[1], None
+    with CaptureQueriesContext(connection) as queries:
+        item.save()
+
+    assert count_updates(queries, "api_item") + count_updates(queries, "api_item_photos") == 2
+    item.refresh_from_db()
+    assert (item.general_photo_one, item.general_photo_two) == (photos[1], None)
+    assert list(Item_Photos.objects.filter(item=item).order_by("pk").values_list("is_general_one", "is_general_two")) == [
+        (False, False), (True, False)]
+    assert item.card.general_photo_one
+
+@pytest.mark.django_db
+def test_item_rejects_general_photo_of_another_item(item):
+    other = Item.objects.create(name="Other", price=50)
+    foreign = Item_Photos.objects.create(item=other, photo=Photo.objects.create(name="foreign", photo="test.jpg"))
+
+    # Форма админки вызывает clean модели: чужое фото не становится главным
+    item.general_photo_one = foreign
+    with pytest.raises(ValidationError):
+        item.clean()
+    assert Item.objects.get(pk=item.pk).general_photo_one is None
+    assert not Item_Photos.objects.get(pk=foreign.pk).is_general_one
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ кэша справочников
+# ===============================
+@pytest.mark.django_db
+def test_color_cache_resolves_names_without_queries(color, django_assert_num_queries):
+    color_cache.get_ids([color.name])
+
+    with django_assert_num_queries(0):
+        assert color_cache.get_ids([color.name]) == [color.id]
+        assert color_cache.get(color.id).hex == color.hex
+        assert color_cache.get_ids(["Unknown"]) == []
+
+    color.name = "Crimson"
+    color.save()
+    assert color_cache.get_ids(["Crimson"]) == [color.id]
+    assert color_cache.get_ids(["Red"]) == []
+
+@pytest.mark.django_db
+def test_color_cache_sees_rows_written_without_signals(tmp_path, color, monkeypatch):
+    color_cache.get_ids([color.name])
+    path = tmp_path / "catalog.csv"
+    path.write_text("id,name,price,color,hex,size,quantity\n"
+                    "601,Куртка,1000,Olive,#808000,XL,2\n", encoding="utf-8")
+
+    # Импорт создаёт цвета через bulk_create и сам сбрасывает кэш
+    call_command("import_catalog", str(path), stdout=StringIO())
+    assert color_cache.get_ids(["Olive"]) == [Color.objects.get(name="Olive").id]
+
+    # Промах перечитывает таблицу не чаще раза в check_interval
+    Color.objects.filter(pk=color.pk).update(name="Scarlet")
+    assert color_cache.get_ids(["Scarlet"]) == []
+    monkeypatch.setattr(color_cache, "loaded_at", color_cache.loaded_at - color_cache.check_interval)
+    assert color_cache.get_ids(["Scarlet"]) == [color.id]
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ «с этим товаром покупают»
+# ===============================
+@pytest.mark.django_db(transaction=True)
+def test_also_bought_from_paid_orders(api_client, color, size):
+    from authentication.models import FrontendUser
+    from api.models import ItemCooccurrence
+    from orders.models import Order, OrderItem
+
+    user = FrontendUser.objects.create_user(telNo="+79890000001", password="password")
+    items = [Item.objects.create(name=f"Item {index}", price=100) for index in range(4)]
+    stocks = [ItemStock.objects.create(item=item, color=color, size=size, quantity=5) for item in items]
+
+    def order(status, *indexes):
+        created = Order.objects.create(user=user, status=status)
+        for index in indexes:
+            OrderItem.objects.create(order=created, product=stocks[index])
+
+    order("paid", 0, 1, 2)
+    order("delivered", 0, 1)
+    order("created", 0, 3)  # не оплачен — не учитывается
+    call_command("build_recommendations", stdout=StringIO())
+
+    url = reverse("item-also-bought", kwargs={"pk": items[0].id})
+    assert [card["id"] for card in api_client.get(url).data] == [items[1].id, items[2].id]
+
+    # Новые оплаченные заказы учитываются инкрементально
+    order("paid", 0, 2)
+    order("paid", 0, 2)
+    call_command("build_recommendations", stdout=StringIO())
+    assert [card["id"] for card in api_client.get(url).data] == [items[2].id, items[1].id]
+    assert Order.objects.filter(counted_in_recommendations=True).count() == 4
+
+    # Учтённый заказ второй раз не считается, а счётчики только прибавляются
+    from api.management.commands.build_recommendations import Command
+    command = Command()
+    command.add_counts({(items[0].id, items[1].id): 2})
+    pending = Order.objects.create(user=user, status="paid")
+    OrderItem.objects.create(order=pending, product=stocks[0])
+    assert command.count_orders([pending.id]) == (1, set())
+    assert command.count_orders([pending.id]) == (0, set())
+    assert ItemCooccurrence.objects.get(item=items[0], other=items[1]).count == 4
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ популярности
+# ===============================
+@pytest.mark.django_db
+def test_popularity_decays_with_age(api_client, category, color, size):
+    from datetime import timedelta
+    from django.utils import timezone
+    from authentication.models import FrontendUser
+    from orders.models import Order, OrderItem
+
+    user = FrontendUser.objects.create_user(telNo="+79890000002", password="password")
+    old, recent, viewed = [Item.objects.create(name=f"Item {index}", price=100) for index in range(3)]
+    for item in (old, recent, viewed):
+        item.categories.add(category)
+
+    def sell(item, quantity, days_ago):
+        order = Order.objects.create(user=user, status="paid")
+        stock = ItemStock.objects.create(item=item, color=color, size=size, quantity=5)
+        OrderItem.objects.create(order=order, product=stock, quantity=quantity)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    sell(old, 2, 28)  # два периода полураспада: 2 * 0.25
+    sell(recent, 1, 0)
+    url = reverse("category-items-detail", kwargs={"category_slug": "test-category", "pk": viewed.id})
+    for _ in range(3):
+        assert api_client.get(url).status_code == status.HTTP_200_OK
+    popularity.flush_views()
+
+    call_command("update_popularity", stdout=StringIO())
+
+    old.refresh_from_db()
+    recent.refresh_from_db()
+    viewed.refresh_from_db()
+    assert recent.popularity == pytest.approx(1)
+    assert old.popularity == pytest.approx(0.5)
+    assert viewed.popularity == pytest.approx(0.15)
+
+    # Популярные товары идут первыми по умолчанию, и в списке, и в карточках
+    response = api_client.get(reverse("item-list"))
+    assert [item["id"] for item in response.data] == [recent.id, old.id, viewed.id]
+    response = api_client.get(reverse("category-items-cards", kwargs={"category_slug": "test-category"}))
+    assert [card["id"] for card in response.data] == [recent.id, old.id, viewed.id]
+
+@pytest.mark.django_db(transaction=True)
+def test_buffered_views_are_flushed_by_timer(api_client, settings, category):
+    from api.models import ItemDailyViews
+
+    settings.POPULARITY_VIEW_FLUSH_INTERVAL = 0.5
+    item = Item.objects.create(name="Viewed", price=100)
+    item.categories.add(category)
+    url = reverse("category-items-detail", kwargs={"category_slug": "test-category", "pk": item.id})
+    for _ in range(2):
+        assert api_client.get(url).status_code == status.HTTP_200_OK
+
+    # Меньше POPULARITY_VIEW_FLUSH_SIZE просмотров: их записывает таймер, а не следующий запрос
+    popularity._timer.join()
+    assert ItemDailyViews.objects.get(item=item).views == 2
+
+    call_command("update_popularity", stdout=StringIO())
+    item.refresh_from_db()
+    assert item.popularity == pytest.approx(0.1)
+
+# ===============================
+# 🔹 ТЕСТЫ ДЛЯ админки
+# ===============================
+@pytest.mark.django_db
+def test_admin_changelists_run_in_constant_queries(client, color, size):
+    from api.models import size_cache
+    from authentication.models import FrontendUser
+    from purchases.models import Basket, BasketItem
+
+    admin = get_user_model().objects.create_superuser(email="admin@example.com", password="password")
+    client.force_login(admin)
+    color_cache.load()
+    size_cache.load()
+
+    def add_rows(start, count):
+        for index in range(start, start + count):
+            item = Item.objects.create(name=f"Item {index}", price=100)
+            photo = Photo.objects.create(name=f"photo {index}", photo="item/test.jpg")
+            item.general_photo_one = Item_Photos.objects.create(item=item, photo=photo)
+            item.save()
+            stock = ItemStock.objects.create(item=item, color=color, size=size, quantity=5)
+            user = FrontendUser.objects.create_user(telNo=f"+7989100{index:04d}", password="password")
+            BasketItem.objects.create(basket=Basket.objects.create(user=user), product=stock)
+
+    urls = [reverse(f"admin:{name}_changelist") for name in
+            ("api_item", "api_item_photos", "api_itemstock", "purchases_basketitem")]
+
+    def count_queries():
+        counts = []
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                assert client.get(url).status_code == status.HTTP_200_OK
+            counts.append(len(queries))
+        return counts
+
+    add_rows(0, 2)
+    counts = count_queries()
+    add_rows(2, 5)
+    assert count_queries() == counts
+
+
+@pytest.mark.django_db
+def test_item_admin_photo_picker_is_searched_not_rendered(client, item):
+    admin = get_user_model().objects.create_superuser(email="admin@example.com", password="password")
+    client.force_login(admin)
+    attached = Photo.objects.create(name="attached photo", photo="item/test.jpg")
+    Item_Photos.objects.create(item=item, photo=attached)
+    for index in range(30):
+        Photo.objects.create(name=f"free photo {index}", photo="item/test.jpg")
+
+    response = client.get(reverse("admin:api_item_change", args=[item.id]))
+    assert response.status_code == status.HTTP_200_OK
+    assert "attached photo" in response.content.decode()
+    assert "free photo" not in response.content.decode()
+
+    url = reverse("admin:autocomplete")
+    params = {"app_label": "api", "model_name": "item_photos", "field_name": "photo"}
+    results = client.get(url, {**params, "term": "PHOTO 2"}).json()["results"]
+    assert {result["text"] for result in results} == {f"free photo {index}" for index in range(30) if "2" in str(index)}
+    assert client.get(url, {**params, "term": "attached"}).json()["results"] == []
@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    # Загрузки и производные не попадают в настоящий MEDIA_ROOT
+    settings.MEDIA_ROOT = str(tmp_path)
@@ -5,6 +5,7 @@ from purchases.models import Basket, BasketItem, Payment, Favourites, Favourites
 from rest_framework.test import APIClient
 from authentication.models import FrontendUser
 from api.models import Item, ItemStock, Color, Size
+from orders.models import Order
 
 @pytest.fixture
 def api_client():
@@ -34,6 +35,12 @@ def size(db):
     return Size.objects.create(name="M")
 
 
+@pytest.fixture
+def other_size(db):
+    """Размер, для которого у товара нет варианта."""
+    return Size.objects.create(name="L")
+
+
 @pytest.fixture
 def item(db):
     """Создает тестовый товар."""
@@ -86,6 +93,33 @@ class TestBasketViewSet:
 
         assert response.status_code == status.HTTP_201_CREATED
 
+    def test_add_to_basket_accumulates_quantity(self, api_client, user, basket, item_stock, other_size):
+        """Повторное добавление увеличивает количество, несуществующий вариант — 404."""
+        api_client.force_authenticate(user=user)
+        url = reverse("purchases:add-to-cart")
+        data = {"item_id": item_stock.item.id, "color": "Red", "size": "M", "quantity": 2}
+
+        assert api_client.post(url, data, format="json").data["quantity"] == 2
+        response = api_client.post(url, {**data, "quantity": 3}, format="json")
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data["quantity"] == 5
+        assert BasketItem.objects.filter(basket=basket).count() == 1
+
+        response = api_client.post(url, {**data, "size": other_size.name}, format="json")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_add_to_basket_with_duplicate_color_name(self, api_client, user, basket, item, color, size):
+        """Вариант находится, даже если он заведён под вторым цветом с тем же именем."""
+        duplicate = Color.objects.create(name=color.name)
+        stock = ItemStock.objects.create(item=item, color=duplicate, size=size, quantity=10)
+        api_client.force_authenticate(user=user)
+        url = reverse("purchases:add-to-cart")
+        data = {"item_id": item.id, "color": color.name, "size": size.name, "quantity": 1}
+
+        response = api_client.post(url, data, format="json")
+        assert response.status_code == status.HTTP_201_CREATED
+        assert BasketItem.objects.get(basket=basket).product == stock
+
 @pytest.mark.django_db
 class TestUpdateBasketItemView:
 
@@ -146,3 +180,25 @@ class TestPaymentsViewSet:
         assert response.status_code == status.HTTP_201_CREATED
 
 
+
+
+@pytest.mark.django_db
+class TestWebhookView:
+
+    def test_succeeded_payment_decrements_stock(self, api_client, user, basket, basket_item, item_stock):
+        """Тест списания остатков при успешной оплате."""
+        payment = Payment.objects.create(user=user, basket=basket, amount=1000, yookassa_payment_id="yk-1")
+        Order.objects.create(user=user, payment=payment)
+
+        url = reverse("purchases:webhook")
+        data = {"object": {"id": "yk-1", "status": "succeeded"}}
+        response = api_client.post(url, data, format="json")
+
+        assert response.status_code == status.HTTP_200_OK
+        item_stock.refresh_from_db()
+        item_stock.item.refresh_from_db()
+        assert item_stock.quantity == 9
+        assert item_stock.item.total_stock == 9
+        assert item_stock.item.is_in_stock
+        assert item_stock.item.order_count == 1
+        assert not BasketItem.objects.filter(basket=basket).exists()
@@ -1,13 +1,17 @@
 import pytest
 from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
-from user_profile.models import Address, Review, ReviewPhoto
+from user_profile.models import Address, Review, ReviewPhoto, ItemRating
 from django.core.files.uploadedfile import SimpleUploadedFile
 from authentication.models import FrontendUser
 from api.models import Item
 from django.urls import reverse
 from PIL import Image
 import io
+from decimal import Decimal
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 User = get_user_model()
 
@@ -161,3 +165,159 @@ def test_delete_review_photo(auth_client, review_photo):
     response = auth_client.delete(url)
     assert response.status_code == 204
     assert ReviewPhoto.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_replace_review_photo_resets_derivatives(auth_client, review_photo, monkeypatch):
+    from api import images
+
+    scheduled, deleted = [], []
+    monkeypatch.setattr(images, "schedule_derivatives", scheduled.append)
+    monkeypatch.setattr(images, "schedule_delete", lambda file: deleted.append(file.name))
+    ReviewPhoto.objects.filter(pk=review_photo.pk).update(derivatives={"webp": [320]})
+    old_name = review_photo.photo.name
+
+    image_io = io.BytesIO()
+    Image.new("RGB", (100, 100), "white").save(image_io, format="JPEG")
+    file = SimpleUploadedFile("other.jpg", image_io.getvalue(), content_type="image/jpeg")
+    url = reverse("user_profile:reviewphoto-detail", args=[review_photo.id])
+    response = auth_client.patch(url, {"photo": file}, format="multipart")
+
+    # Старый файл удаляется, производные строятся для нового, а srcset не обещает старые
+    assert response.status_code == 200, response.data
+    review_photo.refresh_from_db()
+    assert review_photo.derivatives == {}
+    assert response.data["srcset"] is None
+    assert deleted == [old_name]
+    assert scheduled == [review_photo.photo.name]
+
+
+# =========================== Тесты для рейтинга товара ===========================
+
+@pytest.mark.django_db
+def test_item_rating_follows_reviews(user, item, django_assert_max_num_queries):
+    other = FrontendUser.objects.create_user(telNo="+79890000000", password="testpassword")
+    first = Review.objects.create(user=user, item=item, grade=5)
+    Review.objects.create(user=other, item=item, grade=2)
+
+    item.refresh_from_db()
+    assert item.rating == Decimal("3.5")
+    assert item.rating_stats.histogram == {0: 0, 1: 0, 2: 1, 3: 0, 4: 0, 5: 1}
+
+    first = Review.objects.get(pk=first.pk)
+    first.grade = 4
+    # Без пересчёта Avg по всем отзывам
+    with django_assert_max_num_queries(10) as queries:
+        first.save()
+    assert not any("AVG(" in query["sql"] for query in queries)
+
+    first.delete()
+    item.refresh_from_db()
+    assert (item.rating, item.rating_stats.rating_count, item.rating_stats.rating_sum) == (Decimal("2.0"), 1, 2)
+
+
+@pytest.mark.django_db
+def test_review_keeping_rating_leaves_item_alone(user, item):
+    Review.objects.create(user=user, item=item, grade=5)
+    other = FrontendUser.objects.create_user(telNo="+79890000000", password="testpassword")
+
+    def item_row_version():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT ctid::text FROM api_item WHERE id = %s', [item.pk])
+            return cursor.fetchone()[0]
+
+    # Округлённый рейтинг не изменился: ни строки товара, ни карточки, ни версии кэша
+    version = item_row_version()
+    with CaptureQueriesContext(connection) as queries:
+        Review.objects.create(user=other, item=item, grade=5)
+    assert item_row_version() == version
+    assert not [query for query in queries
+                if '"api_itemcard"' in query["sql"] or '"api_catalogcounter"' in query["sql"]]
+    assert item.rating_stats.rating_count == 2
+
+
+@pytest.mark.django_db
+def test_repair_item_ratings(review, item):
+    ItemRating.objects.filter(item=item).update(rating_sum=0, rating_count=0, grade_5=0)
+    item.__class__.objects.filter(pk=item.pk).update(rating=0)
+
+    call_command("repair_item_ratings", stdout=io.StringIO())
+
+    item.refresh_from_db()
+    assert item.rating == 5
+    assert item.rating_stats.grade_5 == 1
+
+
+@pytest.mark.django_db
+def test_get_reviews_keyset_pages(api_client, item, django_assert_max_num_queries):
+    for index in range(5):
+        reviewer = FrontendUser.objects.create_user(telNo=f"+7989000000{index}", password="testpassword")
+        review = Review.objects.create(user=reviewer, item=item, grade=index)
+        ReviewPhoto.objects.create(review=review, photo="review_photos/photo.jpg")
+
+    url = reverse("user_profile:review-list") + f"?item={item.id}&sort=grade_desc&limit=2&cursor="
+    # Пользователи и фото загружаются пачкой, а не по запросу на отзыв
+    with django_assert_max_num_queries(2):
+        response = api_client.get(url)
+    grades = [row["grade"] for row in response.data["results"]]
+
+    while response.data["next"]:
+        response = api_client.get(response.data["next"])
+        grades += [row["grade"] for row in response.data["results"]]
+
+    assert grades == [4, 3, 2, 1, 0]
+
+
+@pytest.mark.django_db
+def test_review_sort_orderings_are_served_by_indexes(item):
+    from user_profile.views import ReviewViewSet
+
+    with connection.cursor() as cursor:
+        # На пустой таблице сортировка дешевле индекса, поэтому Sort запрещён:
+        # он останется в плане, только если индекс не подходит
+        cursor.execute("SET LOCAL enable_sort = off; SET LOCAL enable_bitmapscan = off")
+    # Каждая сортировка читается из индекса без отдельного шага Sort
+    for ordering in [*ReviewViewSet.sort_orderings.values(), ReviewViewSet.default_ordering]:
+        plan = Review.objects.filter(item=item).order_by(*ordering)[:11].explain()
+        assert "Sort" not in plan, (ordering, plan)
+
+
+@pytest.mark.django_db
+def test_get_reviews_keyset_pages_by_created_at(api_client, item):
+    from datetime import timedelta
+    from django.utils import timezone
+
+    # Отзывы в пределах одной миллисекунды: курсор должен хранить микросекунды
+    started = timezone.now()
+    comments = []
+    for index in range(5):
+        reviewer = FrontendUser.objects.create_user(telNo=f"+7989000001{index}", password="testpassword")
+        review = Review.objects.create(user=reviewer, item=item, grade=5, comments=f"review {index}")
+        Review.objects.filter(pk=review.pk).update(created_at=started + timedelta(microseconds=100 * index))
+        comments.append(review.comments)
+
+    for sort, expected in (("", comments[::-1]), ("&sort=oldest", comments)):
+        response = api_client.get(reverse("user_profile:review-list") + f"?item={item.id}&limit=2&cursor={sort}")
+        pages = [[row["comments"] for row in response.data["results"]]]
+        while response.data["next"]:
+            response = api_client.get(response.data["next"])
+            pages.append([row["comments"] for row in response.data["results"]])
+        assert sum(pages, []) == expected
+
+        # И обратно по ссылкам previous
+        while response.data["previous"]:
+            response = api_client.get(response.data["previous"])
+            assert [row["comments"] for row in response.data["results"]] == pages[-2]
+            pages.pop()
+
+
+@pytest.mark.django_db
+def test_reviews_summary(api_client, review, item):
+    url = reverse("user_profile:review-summary")
+    response = api_client.get(url + f"?item={item.id}")
+
+    assert response.status_code == 200
+    assert response.data["average"] == 5
+    assert response.data["count"] == 1
+    assert response.data["histogram"]["5"] == 1
+    assert api_client.get(url).status_code == 400
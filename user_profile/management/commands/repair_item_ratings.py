@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Item
+from user_profile.models import ItemRating
+
+
+class Command(BaseCommand):
+    help = 'Recompute the ItemRating aggregates and Item.rating of every item from its reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        item_ids = list(Item.objects.order_by('pk').values_list('pk', flat=True))
+
+        for start in range(0, len(item_ids), batch_size):
+            ItemRating.rebuild(item_ids[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(f'Repaired ratings of {len(item_ids)} items'))
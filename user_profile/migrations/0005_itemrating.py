@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_item_ratings(apps, schema_editor):
+    Review = apps.get_model('user_profile', 'Review')
+    ItemRating = apps.get_model('user_profile', 'ItemRating')
+    rows = Review.objects.values('item_id').annotate(
+        rating_sum=Sum('grade'),
+        rating_count=Count('pk'),
+        **{f'grade_{grade}': Count('pk', filter=Q(grade=grade)) for grade in range(0, 6)},
+    )
+    ItemRating.objects.bulk_create([ItemRating(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_alter_item_rating'),
+        ('user_profile', '0004_review_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemRating',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to='api.item')),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('grade_0', models.PositiveIntegerField(default=0)),
+                ('grade_1', models.PositiveIntegerField(default=0)),
+                ('grade_2', models.PositiveIntegerField(default=0)),
+                ('grade_3', models.PositiveIntegerField(default=0)),
+                ('grade_4', models.PositiveIntegerField(default=0)),
+                ('grade_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_item_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_alter_item_rating'),
+        ('authentication', '0004_alter_telnocode_expires'),
+        ('user_profile', '0005_itemrating'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['item', 'created_at', 'id'], name='review_item_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['item', 'grade', 'created_at', 'id'], name='review_item_grade_idx'),
+        ),
+    ]
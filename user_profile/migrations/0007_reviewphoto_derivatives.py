@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_profile', '0006_review_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reviewphoto',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
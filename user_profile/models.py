@@ -1,11 +1,17 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.db.models.signals import post_save, post_delete
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 
-from api.models import Item
+from api import cache as catalog_cache
+from api import images
+from api.models import Item, is_item_cascade, refresh_item_cards
 from authentication.models import FrontendUser
 
+GRADES = range(0, 6)
+
 
 class Address(models.Model):
     user = models.ForeignKey(FrontendUser, on_delete=models.CASCADE, related_name='addresses')
@@ -26,21 +32,157 @@ class Review(models.Model):
     disadvantages = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'created_at', 'id'], name='review_item_created_idx'),
+            models.Index(fields=['item', 'grade', 'created_at', 'id'], name='review_item_grade_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the row held when loaded, so a save or delete knows which grade to take back out.
+        loaded = dict(zip(field_names, values))
+        instance._loaded_rating = (loaded.get('item_id'), loaded.get('grade'))
+        return instance
+
     def __str__(self):
         return f'Review by {self.user} for {self.item}'
 
 
+class ItemRating(models.Model):
+    """Review aggregates of an item, moved by F() deltas on every review write instead of re-averaged."""
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats')
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    grade_0 = models.PositiveIntegerField(default=0)
+    grade_1 = models.PositiveIntegerField(default=0)
+    grade_2 = models.PositiveIntegerField(default=0)
+    grade_3 = models.PositiveIntegerField(default=0)
+    grade_4 = models.PositiveIntegerField(default=0)
+    grade_5 = models.PositiveIntegerField(default=0)
+
+    @property
+    def histogram(self):
+        return {grade: getattr(self, f'grade_{grade}') for grade in GRADES}
+
+    @classmethod
+    def apply(cls, item_id, added=None, removed=None):
+        """
+        Add and/or take back one review grade, then refresh `Item.rating` from
+        the aggregates. The item row, its card and the catalog cache are only
+        touched when the displayed (rounded) rating moves.
+        """
+        deltas = {}
+        for grade, sign in ((added, 1), (removed, -1)):
+            if grade is None:
+                continue
+            for field, delta in (('rating_sum', grade), ('rating_count', 1), (f'grade_{grade}', 1)):
+                deltas[field] = deltas.get(field, 0) + sign * delta
+        updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if not updates:
+            return
+
+        with transaction.atomic():
+            if not cls.objects.filter(item_id=item_id).update(**updates):
+                cls.objects.get_or_create(item_id=item_id)
+                cls.objects.filter(item_id=item_id).update(**updates)
+            changed = cls.update_item_ratings([item_id])
+        if changed:
+            refresh_item_cards([item_id])
+            catalog_cache.bump_version(catalog_cache.ITEMS)
+
+    @classmethod
+    def rebuild(cls, item_ids):
+        """Recompute the aggregates of the given items from their reviews with one grouped query and one upsert."""
+        item_ids = set(item_ids)
+        rows = Review.objects.filter(item_id__in=item_ids).values('item_id').annotate(
+            rating_sum=Sum('grade'),
+            rating_count=Count('pk'),
+            **{f'grade_{grade}': Count('pk', filter=Q(grade=grade)) for grade in GRADES},
+        )
+        ratings = {item_id: cls(item_id=item_id) for item_id in item_ids}
+        for row in rows:
+            rating = ratings[row.pop('item_id')]
+            for field, value in row.items():
+                setattr(rating, field, value)
+        cls.objects.bulk_create(
+            ratings.values(),
+            update_conflicts=True,
+            unique_fields=['item'],
+            update_fields=[field.name for field in cls._meta.concrete_fields if not field.primary_key],
+        )
+        if cls.update_item_ratings(item_ids):
+            refresh_item_cards(item_ids)
+            catalog_cache.bump_version(catalog_cache.ITEMS)
+
+    @classmethod
+    def update_item_ratings(cls, item_ids):
+        """Copy the rounded averages into `Item.rating` where they differ; returns how many items changed."""
+        average = cls.objects.filter(item=OuterRef('pk')).values(
+            average=Cast(Cast('rating_sum', DecimalField(max_digits=12, decimal_places=4))
+                         / NullIf('rating_count', 0), DecimalField(max_digits=2, decimal_places=1)))
+        rating = Coalesce(Subquery(average), 0, output_field=DecimalField())
+        # Rows filtered out by the WHERE clause are neither written nor locked.
+        return Item.objects.filter(pk__in=item_ids).exclude(rating=rating).update(rating=rating)
+
+    def __str__(self):
+        return f'Rating of {self.item_id}'
+
+
 class ReviewPhoto(models.Model):
     review = models.ForeignKey(Review, related_name='photos', on_delete=models.CASCADE)
     photo = models.ImageField(upload_to='review_photos/')
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f'Photo for review {self.review.id}'
 
 @receiver(post_save, sender=Review)
-def update_item_rating_on_save(sender, instance, **kwargs):
-    instance.item.update_rating()
+def update_item_rating_on_save(sender, instance, created, **kwargs):
+    loaded_item_id, loaded_grade = getattr(instance, '_loaded_rating', (None, None))
+    if created:
+        ItemRating.apply(instance.item_id, added=instance.grade)
+    elif loaded_item_id is None:
+        # Saved from an instance that was never loaded: the previous grade is unknown.
+        ItemRating.rebuild([instance.item_id])
+    elif loaded_item_id != instance.item_id:
+        ItemRating.apply(loaded_item_id, removed=loaded_grade)
+        ItemRating.apply(instance.item_id, added=instance.grade)
+    else:
+        ItemRating.apply(instance.item_id, added=instance.grade, removed=loaded_grade)
+    instance._loaded_rating = (instance.item_id, instance.grade)
 
 @receiver(post_delete, sender=Review)
 def update_item_rating_on_delete(sender, instance, **kwargs):
-    instance.item.update_rating()
+    if is_item_cascade(kwargs):
+        return
+    loaded_item_id, loaded_grade = getattr(instance, '_loaded_rating', (instance.item_id, instance.grade))
+    ItemRating.apply(loaded_item_id, removed=loaded_grade)
+
+@receiver(pre_save, sender=ReviewPhoto)
+def delete_old_review_photo_file(sender, instance, **kwargs):
+    if not instance.pk:
+        instance._photo_changed = True
+        return False
+
+    try:
+        old_instance = ReviewPhoto.objects.get(pk=instance.pk)
+    except ReviewPhoto.DoesNotExist:
+        return False
+
+    if old_instance.photo != instance.photo:
+        instance._photo_changed = True
+        instance.derivatives = {}
+    if old_instance.photo and old_instance.photo != instance.photo:
+        images.schedule_delete(old_instance.photo)
+
+@receiver(post_save, sender=ReviewPhoto)
+def schedule_review_photo_derivatives(sender, instance, **kwargs):
+    if getattr(instance, '_photo_changed', False):
+        instance._photo_changed = False
+        images.schedule_derivatives(instance.photo.name)
+
+@receiver(post_delete, sender=ReviewPhoto)
+def delete_review_photo_file(sender, instance, **kwargs):
+    images.schedule_delete(instance.photo)
@@ -5,6 +5,7 @@ from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from api import images
 from user_profile.models import Address, ReviewPhoto, Review
 
 logger = logging.getLogger(__name__)
@@ -16,9 +17,15 @@ class AddressSerializer(serializers.ModelSerializer):
 
 
 class ReviewPhotoSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ReviewPhoto
-        fields = '__all__'
+        exclude = ['derivatives']
+
+    def get_srcset(self, obj):
+        request = self.context.get('request')
+        return images.get_srcset(obj.photo.name, obj.derivatives, request.build_absolute_uri if request else None)
 
 
 
@@ -1,12 +1,14 @@
 import logging
 from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 
+from api.pagination import KeysetLimitOffsetPagination
 from authentication.backends import CookieJWTAuthentication
-from user_profile.models import Address, Review, ReviewPhoto
+from user_profile.models import Address, Review, ReviewPhoto, ItemRating
 from user_profile.serializers import AddressSerializer, ReviewSerializer, ReviewPhotoSerializer
 
 # Настройка логирования
@@ -52,12 +54,38 @@ class ReviewViewSet(viewsets.ModelViewSet):
     authentication_classes = [CookieJWTAuthentication]
     permission_classes = [IsAuthenticatedOrReadOnly]
     parser_classes = (MultiPartParser, FormParser)
+    pagination_class = KeysetLimitOffsetPagination
+    sort_orderings = {
+        'oldest': ('created_at', 'pk'),
+        'grade_desc': ('-grade', '-created_at', '-pk'),
+        # One direction per ordering, so review_item_grade_idx serves it forwards or backwards.
+        'grade_asc': ('grade', 'created_at', 'pk'),
+    }
+    default_ordering = ('-created_at', '-pk')
 
     def get_queryset(self):
+        queryset = self.queryset.select_related('user').prefetch_related('photos')
         item_id = self.request.query_params.get('item')
         if item_id:
-            return self.queryset.filter(item_id=item_id)
-        return self.queryset
+            queryset = queryset.filter(item_id=item_id)
+        sort = self.request.query_params.get('sort')
+        return queryset.order_by(*self.sort_orderings.get(sort, self.default_ordering))
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request, *args, **kwargs):
+        """Average, count and grade histogram of `?item=` from the precomputed ItemRating row."""
+        item_id = request.query_params.get('item')
+        if not item_id or not item_id.isdigit():
+            raise ValidationError({"error": True, "message": "Параметр item обязателен"})
+
+        rating = ItemRating.objects.filter(item_id=item_id).first() or ItemRating(item_id=item_id)
+        average = round(rating.rating_sum / rating.rating_count, 2) if rating.rating_count else 0
+        return Response({
+            'item': int(item_id),
+            'average': average,
+            'count': rating.rating_count,
+            'histogram': {str(grade): count for grade, count in rating.histogram.items()},
+        })
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)